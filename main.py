@@ -11,12 +11,31 @@ import logging
 import re
 import asyncio
 import base64
+import bisect
+import hashlib
+import heapq
+import html
 import io
+import itertools
 import random
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List, Tuple
+import time
+from collections import OrderedDict
+from datetime import datetime, date
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Any, Optional, List, Tuple
+import aiohttp
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Fall back to stdlib json if orjson isn't installed
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # Photos are sent at original size if Pillow isn't installed
+
 from telegram import Update, PhotoSize, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, LabeledPrice
 from telegram.ext import (
     Application,
@@ -28,8 +47,11 @@ from telegram.ext import (
     filters,
     ContextTypes,
     JobQueue,
+    AIORateLimiter,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
+from telegram.request import HTTPXRequest
 
 # Conversation states for broadcast
 WAITING_FOR_BROADCAST_CAPTION = 1
@@ -56,11 +78,28 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+# httpx logs one INFO line per Bot API request, which swamps the log during
+# broadcasts
+logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 OWNER_USER_ID = os.getenv('OWNER_USER_ID')  # Bot owner's Telegram user ID for admin access
+
+# Parsed once (supports a comma-separated list) so is_owner() is a single
+# C-level frozenset membership test on every message
+_owner_ids = []
+for _part in (OWNER_USER_ID or '').split(','):
+    _part = _part.strip()
+    if _part:
+        try:
+            _owner_ids.append(int(_part))
+        except ValueError:
+            pass
+OWNER_IDS = frozenset(_owner_ids)
+_PRIMARY_OWNER_ID = _owner_ids[0] if _owner_ids else None
+del _owner_ids
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -81,16 +120,21 @@ OWNER_AI_ENABLED = True
 class AdManager:
     """Manage advertisement configuration"""
 
+    # Seconds to coalesce write-behind saves before hitting the disk
+    FLUSH_INTERVAL = 0.5
+
     def __init__(self, filename: str = AD_CONFIG_FILE):
         self.filename = filename
         self.config = self._load_config()
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
 
     def _load_config(self) -> Dict[str, Any]:
         """Load ad configuration from JSON file"""
         try:
             if os.path.exists(self.filename):
-                with open(self.filename, 'r') as f:
-                    return json.load(f)
+                with open(self.filename, 'rb') as f:
+                    return orjson.loads(f.read()) if orjson is not None else json.loads(f.read())
         except Exception as e:
             logger.error(f"Error loading ad config: {e}")
 
@@ -103,15 +147,53 @@ class AdManager:
             'image_caption': '📢 Check out our latest offers!'
         }
 
-    def _save_config(self):
-        """Save ad configuration to JSON file"""
+    def _write_config(self):
+        """Write the configuration atomically via tmp + rename (blocking)"""
+        tmp = self.filename + '.tmp'
         try:
-            with open(self.filename, 'w') as f:
-                json.dump(self.config, f, indent=2)
-            logger.info("[AD] Configuration saved")
+            if orjson is not None:
+                with open(tmp, 'wb') as f:
+                    f.write(orjson.dumps(self.config))
+            else:
+                with open(tmp, 'w') as f:
+                    json.dump(self.config, f, separators=(',', ':'))
+            os.replace(tmp, self.filename)
         except Exception as e:
             logger.error(f"Error saving ad config: {e}")
 
+    def _save_config(self):
+        """Queue a debounced save instead of blocking the handler on disk I/O"""
+        self._dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Start the debounced flush task if one isn't already pending"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop yet (e.g. startup) - write synchronously
+            self._dirty = False
+            self._write_config()
+            return
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Coalesce dirty writes into one save per FLUSH_INTERVAL"""
+        await asyncio.sleep(self.FLUSH_INTERVAL)
+        if self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._write_config)
+
+    async def flush(self):
+        """Flush any pending changes to disk immediately (used on shutdown)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._dirty:
+            self._dirty = False
+            self._write_config()
+
     def is_enabled(self) -> bool:
         """Check if ads are enabled"""
         return self.config.get('enabled', False)
@@ -174,29 +256,129 @@ ad_manager = AdManager()
 class AdScheduler:
     """Manage scheduled advertisements with auto-posting and timer functionality"""
 
+    # Seconds to coalesce write-behind saves before hitting the disk
+    FLUSH_INTERVAL = 0.5
+
     def __init__(self, filename: str = SCHEDULED_ADS_FILE):
         self.filename = filename
         self.ads = self._load_ads()
-        self.posted_message_ids = {}  # Track message IDs for deletion: {ad_id: {chat_id: message_id}}
+        # Track message IDs for deletion: {ad_id: {chat_id: message_id}}.
+        # Persisted to a sidecar file so deletes still work after a restart.
+        self._msgids_file = filename + '.msgids'
+        self.posted_message_ids = self._load_posted_message_ids()
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        # Min-heap of (due_epoch, ad_id) so the scheduler tick only looks at
+        # ads that are actually due instead of parsing every timestamp.
+        # _next_post holds the authoritative due time; heap entries that
+        # disagree with it are stale and get dropped on pop.
+        self._heap: List[Tuple[float, str]] = []
+        self._next_post: Dict[str, float] = {}
+        # Wakes the scheduler loop when the schedule changes, so admin edits
+        # take effect immediately instead of at the next poll
+        self._wakeup = asyncio.Event()
+        for ad_id in self.ads:
+            self._reschedule(ad_id)
 
     def _load_ads(self) -> Dict[str, Any]:
         """Load scheduled ads from JSON file"""
         try:
             if os.path.exists(self.filename):
-                with open(self.filename, 'r') as f:
-                    return json.load(f)
+                with open(self.filename, 'rb') as f:
+                    return orjson.loads(f.read()) if orjson is not None else json.loads(f.read())
         except Exception as e:
             logger.error(f"Error loading scheduled ads: {e}")
         return {}
 
-    def _save_ads(self):
-        """Save scheduled ads to JSON file"""
+    def _load_posted_message_ids(self) -> Dict[str, Dict[int, int]]:
+        """Load posted message IDs from the sidecar file"""
         try:
-            with open(self.filename, 'w') as f:
-                json.dump(self.ads, f, indent=2)
-            logger.info("[SCHEDULER] Ads saved successfully")
+            if os.path.exists(self._msgids_file):
+                with open(self._msgids_file, 'rb') as f:
+                    raw = orjson.loads(f.read()) if orjson is not None else json.loads(f.read())
+                # JSON coerces the int chat-id keys to strings; convert back
+                return {ad_id: {int(cid): mid for cid, mid in chats.items()}
+                        for ad_id, chats in raw.items()}
+        except Exception as e:
+            logger.error(f"Error loading posted message ids: {e}")
+        return {}
+
+    def _write_ads(self):
+        """Write the ads file atomically via tmp + rename (blocking)"""
+        tmp = self.filename + '.tmp'
+        try:
+            if orjson is not None:
+                with open(tmp, 'wb') as f:
+                    f.write(orjson.dumps(self.ads))
+            else:
+                with open(tmp, 'w') as f:
+                    json.dump(self.ads, f, separators=(',', ':'))
+            os.replace(tmp, self.filename)
         except Exception as e:
             logger.error(f"Error saving scheduled ads: {e}")
+        tmp = self._msgids_file + '.tmp'
+        try:
+            if orjson is not None:
+                with open(tmp, 'wb') as f:
+                    f.write(orjson.dumps(self.posted_message_ids, option=orjson.OPT_NON_STR_KEYS))
+            else:
+                with open(tmp, 'w') as f:
+                    json.dump(self.posted_message_ids, f, separators=(',', ':'))
+            os.replace(tmp, self._msgids_file)
+        except Exception as e:
+            logger.error(f"Error saving posted message ids: {e}")
+
+    def _save_ads(self):
+        """Queue a debounced save instead of blocking the caller on disk I/O"""
+        self._dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Start the debounced flush task if one isn't already pending"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop yet (e.g. startup) - write synchronously
+            self._dirty = False
+            self._write_ads()
+            return
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Coalesce dirty writes into one save per FLUSH_INTERVAL"""
+        await asyncio.sleep(self.FLUSH_INTERVAL)
+        if self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._write_ads)
+
+    async def flush(self):
+        """Flush any pending changes to disk immediately (used on shutdown)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._dirty:
+            self._dirty = False
+            self._write_ads()
+
+    def _due_at(self, ad_data: Dict[str, Any]) -> float:
+        """Epoch time at which an ad next becomes due (0.0 = immediately)"""
+        last_posted = ad_data.get('last_posted_at')
+        if last_posted is None:
+            return 0.0
+        interval_hours = ad_data.get('interval_hours', 24)
+        return datetime.fromisoformat(last_posted).timestamp() + interval_hours * 3600
+
+    def _reschedule(self, ad_id: str):
+        """Recompute an ad's due time and push it onto the schedule heap"""
+        ad_data = self.ads.get(ad_id)
+        if ad_data is None:
+            self._next_post.pop(ad_id, None)
+            return
+        due = self._due_at(ad_data)
+        self._next_post[ad_id] = due
+        heapq.heappush(self._heap, (due, ad_id))
+        self._wakeup.set()
 
     def create_ad(self, name: str, ad_type: str, content: dict, interval_hours: int,
                   target_groups: List[int], enabled: bool = True) -> str:
@@ -215,6 +397,7 @@ class AdScheduler:
             'total_posts': 0
         }
 
+        self._reschedule(ad_id)
         self._save_ads()
         logger.info(f"[SCHEDULER] Created ad: {ad_id} - {name}")
         return ad_id
@@ -231,6 +414,7 @@ class AdScheduler:
         """Update advertisement fields"""
         if ad_id in self.ads:
             self.ads[ad_id].update(kwargs)
+            self._reschedule(ad_id)
             self._save_ads()
             logger.info(f"[SCHEDULER] Updated ad: {ad_id}")
             return True
@@ -240,6 +424,8 @@ class AdScheduler:
         """Delete an advertisement"""
         if ad_id in self.ads:
             del self.ads[ad_id]
+            self._next_post.pop(ad_id, None)
+            self._wakeup.set()
             if ad_id in self.posted_message_ids:
                 del self.posted_message_ids[ad_id]
             self._save_ads()
@@ -258,23 +444,22 @@ class AdScheduler:
     def get_ads_to_post(self) -> List[Tuple[str, Dict[str, Any]]]:
         """Get advertisements that need to be posted now"""
         ads_to_post = []
-        now = datetime.now()
+        now = time.time()
 
-        for ad_id, ad_data in self.ads.items():
+        while self._heap and self._heap[0][0] <= now:
+            due, ad_id = heapq.heappop(self._heap)
+            ad_data = self.ads.get(ad_id)
+            if ad_data is None or self._next_post.get(ad_id) != due:
+                continue  # deleted or rescheduled since it was pushed
             if not ad_data.get('enabled', False):
+                # Paused; resume_ad() pushes it back when re-enabled
                 continue
+            ads_to_post.append((ad_id, ad_data))
 
-            last_posted = ad_data.get('last_posted_at')
-            interval_hours = ad_data.get('interval_hours', 24)
-
-            # If never posted or interval has passed
-            if last_posted is None:
-                ads_to_post.append((ad_id, ad_data))
-            else:
-                last_posted_time = datetime.fromisoformat(last_posted)
-                time_diff = now - last_posted_time
-                if time_diff >= timedelta(hours=interval_hours):
-                    ads_to_post.append((ad_id, ad_data))
+        # Push due ads back so a failed post is retried next tick;
+        # mark_as_posted() reschedules them past the interval.
+        for ad_id, _ in ads_to_post:
+            heapq.heappush(self._heap, (self._next_post[ad_id], ad_id))
 
         return ads_to_post
 
@@ -289,8 +474,31 @@ class AdScheduler:
                 self.posted_message_ids[ad_id] = {}
             self.posted_message_ids[ad_id][chat_id] = message_id
 
+            self._reschedule(ad_id)
             self._save_ads()
 
+    def next_fire_time(self) -> Optional[float]:
+        """Epoch time of the earliest scheduled enabled ad, or None"""
+        while self._heap:
+            due, ad_id = self._heap[0]
+            ad_data = self.ads.get(ad_id)
+            if ad_data is None or self._next_post.get(ad_id) != due:
+                heapq.heappop(self._heap)  # stale entry
+                continue
+            if not ad_data.get('enabled', False):
+                heapq.heappop(self._heap)  # paused; resume_ad re-pushes
+                continue
+            return due
+        return None
+
+    async def wait_for_change(self):
+        """Wait until the schedule is mutated (create/update/delete/post)"""
+        await self._wakeup.wait()
+
+    def clear_change(self):
+        """Reset the change flag; call before computing the next sleep"""
+        self._wakeup.clear()
+
     def get_posted_messages(self, ad_id: str) -> Dict[int, int]:
         """Get posted message IDs for an ad"""
         return self.posted_message_ids.get(ad_id, {})
@@ -300,6 +508,47 @@ class AdScheduler:
 ad_scheduler = AdScheduler()
 
 
+# ============================================================================
+# Cached timestamp helpers
+# ============================================================================
+# strftime is surprisingly expensive (format parsing + locale lookup) and the
+# tracker calls it on every question, so cache the strings at 1s granularity.
+
+_time_bucket = -1
+_today_str = ''
+_today_ordinal = -1
+_timestamp_str = ''
+
+
+def _update_time_cache():
+    global _time_bucket, _today_str, _today_ordinal, _timestamp_str
+    bucket = int(time.time())
+    if bucket != _time_bucket:
+        _time_bucket = bucket
+        now = datetime.now()
+        _timestamp_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        _today_str = _timestamp_str[:10]
+        _today_ordinal = now.toordinal()
+
+
+def _today() -> str:
+    """Today's date as YYYY-MM-DD, cached at 1s granularity"""
+    _update_time_cache()
+    return _today_str
+
+
+def _timestamp() -> str:
+    """Current time as YYYY-MM-DD HH:MM:SS, cached at 1s granularity"""
+    _update_time_cache()
+    return _timestamp_str
+
+
+def _today_ord() -> int:
+    """Today's date as an integer ordinal, cached at 1s granularity"""
+    _update_time_cache()
+    return _today_ordinal
+
+
 class UserUsageTracker:
     """Track user credits and usage"""
 
@@ -346,60 +595,228 @@ class UserUsageTracker:
         },
     }
 
+    # Seconds to coalesce write-behind saves before hitting the disk
+    FLUSH_INTERVAL = 3.0
+
     def __init__(self, filename: str = USAGE_FILE):
         self.filename = filename
+        self.log_filename = filename + '.log'
         self.data = self._load_data()
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        # Aggregates maintained incrementally so get_statistics stays O(1)
+        # instead of rescanning every user record (one scan here at startup)
+        self._total_questions = sum(
+            user.get('total_questions', 0)
+            for user in self.data.values()
+            if isinstance(user, dict) and 'total_questions' in user
+        )
+        self._user_ids = set(k for k in self.data.keys() if k != 'chats')
+        self._user_ids.update(self.data.get('chats', {}).get('users', {}).keys())
+        # In-memory day ordinals for the daily-reset check; disk keeps the
+        # readable ISO string, the hot path compares ints
+        self._last_reset_ord: Dict[str, int] = {}
+        # Broadcast target lists, kept in sync by track_chat so the
+        # get_all_*_chats helpers don't rebuild them per broadcast
+        self._user_chat_ids = [int(cid) for cid in self.data.get('chats', {}).get('users', {})]
+        self._group_chat_ids = [int(cid) for cid in self.data.get('chats', {}).get('groups', {})]
+        # Combined 'all' target, built lazily and invalidated when a new chat
+        # is tracked
+        self._all_chat_ids: Optional[List[int]] = None
+        # Day ordinal each chat was last recorded; lets track_chat return
+        # without any I/O for chats already seen today
+        self._chat_seen_ord: Dict[str, int] = {}
+        # Persistent append handle for the edit log - opened lazily so each
+        # mutation is write+flush rather than open/write/close
+        self._log_file = None
 
     def _load_data(self) -> Dict[str, Any]:
-        """Load usage data from JSON file"""
+        """Load usage data from the snapshot file, then replay the edit log"""
+        data = {}
         try:
             if os.path.exists(self.filename):
-                with open(self.filename, 'r') as f:
-                    return json.load(f)
+                if orjson is not None:
+                    with open(self.filename, 'rb') as f:
+                        data = orjson.loads(f.read())
+                else:
+                    with open(self.filename, 'r') as f:
+                        data = json.load(f)
         except Exception as e:
             logger.error(f"Error loading usage data: {e}")
-        return {}
+        self._replay_log(data)
+        return data
+
+    def _replay_log(self, data: Dict[str, Any]):
+        """Apply edit-log events recorded since the last snapshot"""
+        if not os.path.exists(self.log_filename):
+            return
+        try:
+            with open(self.log_filename, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    event = orjson.loads(line) if orjson is not None else json.loads(line)
+                    if event.get('kind') == 'user':
+                        data[event['id']] = event['record']
+                    elif event.get('kind') == 'chat':
+                        chats = data.setdefault('chats', {'users': {}, 'groups': {}})
+                        scope = chats.setdefault(event['scope'], {})
+                        if event['record'] is None:
+                            # Tombstone: the chat was removed (bot blocked/kicked)
+                            scope.pop(event['id'], None)
+                        else:
+                            scope[event['id']] = event['record']
+        except Exception as e:
+            logger.error(f"Error replaying usage log: {e}")
 
     def _save_data(self):
-        """Save usage data to JSON file"""
+        """Save usage data to JSON file (atomically, via tmp + rename)"""
+        # Writing the live file in place would corrupt the store if the
+        # process died mid-write; os.replace is atomic on POSIX and Windows.
+        # No fsync - the edit log provides durability, the snapshot is a
+        # rebuildable optimization.
+        tmp = self.filename + '.tmp'
         try:
-            with open(self.filename, 'w') as f:
-                json.dump(self.data, f, indent=2)
+            # Compact output: the snapshot is machine-read only (the edit log
+            # is the human-inspectable record), and skipping indentation keeps
+            # serialize/parse cost down as the store grows
+            if orjson is not None:
+                # orjson serializes straight to bytes and is ~2x faster than stdlib json
+                with open(tmp, 'wb') as f:
+                    f.write(orjson.dumps(self.data))
+            else:
+                with open(tmp, 'w') as f:
+                    json.dump(self.data, f, separators=(',', ':'))
+            os.replace(tmp, self.filename)
         except Exception as e:
             logger.error(f"Error saving usage data: {e}")
 
+    def _append_log(self, event: Dict[str, Any]):
+        """Append one mutation event to the edit log (O(1) per change)"""
+        try:
+            if orjson is not None:
+                line = orjson.dumps(event) + b'\n'
+            else:
+                line = (json.dumps(event) + '\n').encode('utf-8')
+            if self._log_file is None:
+                self._log_file = open(self.log_filename, 'ab')
+            self._log_file.write(line)
+            self._log_file.flush()
+        except Exception as e:
+            logger.error(f"Error appending to usage log: {e}")
+            # Reopen on the next append in case the handle went bad
+            self._close_log()
+
+    def _close_log(self):
+        """Close the edit-log handle (reopened lazily on next append)"""
+        if self._log_file is not None:
+            try:
+                self._log_file.close()
+            except Exception:
+                pass
+            self._log_file = None
+
+    def _log_user_change(self, user_id_str: str):
+        """Record a user mutation in the edit log and queue a snapshot"""
+        self._append_log({'kind': 'user', 'id': user_id_str, 'record': self.data.get(user_id_str)})
+        self._mark_dirty()
+
+    def _log_chat_change(self, scope: str, chat_id_str: str):
+        """Record a chat mutation in the edit log and queue a snapshot"""
+        self._append_log({
+            'kind': 'chat',
+            'scope': scope,
+            'id': chat_id_str,
+            'record': self.data['chats'][scope].get(chat_id_str)
+        })
+        self._mark_dirty()
+
+    def _compact(self):
+        """Write a full snapshot and truncate the edit log"""
+        self._save_data()
+        try:
+            self._close_log()
+            open(self.log_filename, 'wb').close()
+        except Exception as e:
+            logger.error(f"Error truncating usage log: {e}")
+
+    def _mark_dirty(self):
+        """Queue a write-behind snapshot instead of rewriting the file immediately"""
+        self._dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Start the debounced flush task if one isn't already pending"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop yet (e.g. startup) - write synchronously
+            self._dirty = False
+            self._compact()
+            return
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Coalesce dirty writes into one save per FLUSH_INTERVAL"""
+        await asyncio.sleep(self.FLUSH_INTERVAL)
+        if self._dirty:
+            self._dirty = False
+            self._compact()
+
+    async def flush(self):
+        """Flush any pending changes to disk immediately (used on shutdown)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._dirty:
+            self._dirty = False
+            self._compact()
+
     def _ensure_user_exists(self, user_id: int, username: str = None):
         """Ensure user exists in database with initial credits"""
         user_id_str = str(user_id)
         if user_id_str not in self.data:
-            today = datetime.now().strftime('%Y-%m-%d')
+            today = _today()
             self.data[user_id_str] = {
                 'credits': self.INITIAL_CREDITS,
                 'group_credits': self.GROUP_FREE_CREDITS,  # Separate credits for group usage
                 'total_questions': 0,
                 'username': username,
-                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'created_at': _timestamp(),
                 'daily_usage': 0,
                 'last_reset_date': today
             }
-            self._save_data()
+            self._last_reset_ord[user_id_str] = _today_ord()
+            self._user_ids.add(user_id_str)
+            self._log_user_change(user_id_str)
             logger.info(f"[CREDITS] New user {user_id} created with {self.INITIAL_CREDITS} private credits and {self.GROUP_FREE_CREDITS} group credits")
 
     def _check_and_reset_daily_usage(self, user_id: int):
         """Check if it's a new day and reset daily usage if needed"""
         user_id_str = str(user_id)
-        if user_id_str not in self.data:
+        record = self.data.get(user_id_str)
+        if record is None:
             return
 
-        today = datetime.now().strftime('%Y-%m-%d')
-        last_reset = self.data[user_id_str].get('last_reset_date', today)
+        today_ord = _today_ord()
+        last_ord = self._last_reset_ord.get(user_id_str)
+        if last_ord is None:
+            # Backfill once from the ISO string kept on disk
+            try:
+                last_ord = date.fromisoformat(record['last_reset_date']).toordinal()
+            except (KeyError, ValueError):
+                last_ord = today_ord
+            self._last_reset_ord[user_id_str] = last_ord
 
         # If it's a new day, reset daily usage
-        if last_reset != today:
-            self.data[user_id_str]['daily_usage'] = 0
-            self.data[user_id_str]['last_reset_date'] = today
-            self._save_data()
-            logger.info(f"[DAILY LIMIT] Reset daily usage for user {user_id}")
+        if last_ord != today_ord:
+            record['daily_usage'] = 0
+            record['last_reset_date'] = _today()
+            self._last_reset_ord[user_id_str] = today_ord
+            self._log_user_change(user_id_str)
+            logger.debug("[DAILY LIMIT] Reset daily usage for user %s", user_id)
 
     def get_credits(self, user_id: int) -> int:
         """Get user's current credit balance"""
@@ -417,14 +834,16 @@ class UserUsageTracker:
         self._ensure_user_exists(user_id, username)
         user_id_str = str(user_id)
 
-        current_credits = self.data[user_id_str].get('credits', 0)
+        rec = self.data[user_id_str]
+        current_credits = rec.get('credits', 0)
         if current_credits >= cost:
-            self.data[user_id_str]['credits'] = current_credits - cost
-            self.data[user_id_str]['total_questions'] = self.data[user_id_str].get('total_questions', 0) + 1
-            self.data[user_id_str]['username'] = username
-            self.data[user_id_str]['last_question'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self._save_data()
-            logger.info(f"[CREDITS] User {user_id} spent {cost} credits. Remaining: {self.data[user_id_str]['credits']}")
+            rec['credits'] = current_credits - cost
+            rec['total_questions'] = rec.get('total_questions', 0) + 1
+            self._total_questions += 1
+            rec['username'] = username
+            rec['last_question'] = _timestamp()
+            self._log_user_change(user_id_str)
+            logger.debug("[CREDITS] User %s spent %s credits. Remaining: %s", user_id, cost, rec['credits'])
             return True
         return False
 
@@ -433,10 +852,11 @@ class UserUsageTracker:
         self._ensure_user_exists(user_id, username)
         user_id_str = str(user_id)
 
-        new_balance = self.data[user_id_str].get('credits', 0) + amount
-        self.data[user_id_str]['credits'] = new_balance
-        self.data[user_id_str]['username'] = username
-        self._save_data()
+        rec = self.data[user_id_str]
+        new_balance = rec.get('credits', 0) + amount
+        rec['credits'] = new_balance
+        rec['username'] = username
+        self._log_user_change(user_id_str)
         logger.info(f"[CREDITS] Added {amount} credits to user {user_id}. New balance: {new_balance}")
         return new_balance
 
@@ -445,9 +865,10 @@ class UserUsageTracker:
         self._ensure_user_exists(user_id, username)
         user_id_str = str(user_id)
 
-        self.data[user_id_str]['credits'] = amount
-        self.data[user_id_str]['username'] = username
-        self._save_data()
+        rec = self.data[user_id_str]
+        rec['credits'] = amount
+        rec['username'] = username
+        self._log_user_change(user_id_str)
         logger.info(f"[CREDITS] Set user {user_id} credits to {amount}")
         return amount
 
@@ -456,11 +877,11 @@ class UserUsageTracker:
         self._ensure_user_exists(user_id)
         self._check_and_reset_daily_usage(user_id)
 
-        user_id_str = str(user_id)
+        rec = self.data[str(user_id)]
         cost = self.IMAGE_QUESTION_COST if is_image else self.TEXT_QUESTION_COST
 
         # Check daily limit first
-        current_daily_usage = self.data[user_id_str].get('daily_usage', 0)
+        current_daily_usage = rec.get('daily_usage', 0)
         if current_daily_usage + cost > self.DAILY_CREDIT_LIMIT:
             return False
 
@@ -475,67 +896,125 @@ class UserUsageTracker:
         return self.data[user_id_str].get('daily_usage', 0)
 
     def record_question(self, user_id: int, username: str = None, is_image: bool = False):
-        """Record question, deduct credits, and track daily usage"""
-        cost = self.IMAGE_QUESTION_COST if is_image else self.TEXT_QUESTION_COST
-        self.deduct_credits(user_id, cost, username)
+        """Record question, deduct credits, and track daily usage in one pass
 
-        # Track daily usage
+        Folds what used to be deduct_credits + a separate daily-usage update
+        into a single record mutation with one journal append, since every
+        handler that records a question needs both.
+        """
+        cost = self.IMAGE_QUESTION_COST if is_image else self.TEXT_QUESTION_COST
+        self._ensure_user_exists(user_id, username)
         user_id_str = str(user_id)
-        current_daily_usage = self.data[user_id_str].get('daily_usage', 0)
-        self.data[user_id_str]['daily_usage'] = current_daily_usage + cost
-        self._save_data()
-        logger.info(f"[DAILY LIMIT] User {user_id} daily usage: {self.data[user_id_str]['daily_usage']}/{self.DAILY_CREDIT_LIMIT}")
+        rec = self.data[user_id_str]
+
+        current_credits = rec.get('credits', 0)
+        if current_credits >= cost:
+            rec['credits'] = current_credits - cost
+            rec['total_questions'] = rec.get('total_questions', 0) + 1
+            self._total_questions += 1
+            rec['username'] = username
+            rec['last_question'] = _timestamp()
+
+        rec['daily_usage'] = rec.get('daily_usage', 0) + cost
+        self._log_user_change(user_id_str)
+        logger.debug("[DAILY LIMIT] User %s daily usage: %s/%s", user_id, rec['daily_usage'], self.DAILY_CREDIT_LIMIT)
 
     def track_chat(self, chat_id: int, chat_type: str, chat_title: str = None):
         """Track chat IDs for broadcasting (users and groups)"""
+        # Fast path first: already-known chat seen again today - nothing to
+        # record. last_seen is kept at day granularity so repeat messages
+        # cost one dict lookup and zero I/O
+        chat_id_str = str(chat_id)
+        today_ord = _today_ord()
+        if self._chat_seen_ord.get(chat_id_str) == today_ord:
+            return
+        self._chat_seen_ord[chat_id_str] = today_ord
+
         # Store chats in a separate section
         if 'chats' not in self.data:
             self.data['chats'] = {'users': {}, 'groups': {}}
 
-        chat_id_str = str(chat_id)
-
         if chat_type in ['private']:
+            if chat_id_str not in self.data['chats']['users']:
+                self._user_chat_ids.append(chat_id)
+                self._all_chat_ids = None
             self.data['chats']['users'][chat_id_str] = {
-                'last_seen': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'last_seen': _timestamp(),
                 'type': chat_type
             }
+            self._user_ids.add(chat_id_str)
+            self._log_chat_change('users', chat_id_str)
         elif chat_type in ['group', 'supergroup']:
+            if chat_id_str not in self.data['chats']['groups']:
+                self._group_chat_ids.append(chat_id)
+                self._all_chat_ids = None
             self.data['chats']['groups'][chat_id_str] = {
                 'title': chat_title or 'Unknown Group',
-                'last_seen': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'last_seen': _timestamp(),
                 'type': chat_type
             }
-
-        self._save_data()
+            self._log_chat_change('groups', chat_id_str)
 
     def get_all_user_chats(self) -> List[int]:
-        """Get all user chat IDs for broadcasting"""
-        if 'chats' not in self.data or 'users' not in self.data['chats']:
-            return []
-        return [int(chat_id) for chat_id in self.data['chats']['users'].keys()]
+        """Get all user chat IDs for broadcasting (cached; callers only read)"""
+        return self._user_chat_ids
 
     def get_all_group_chats(self) -> List[int]:
-        """Get all group chat IDs for broadcasting"""
-        if 'chats' not in self.data or 'groups' not in self.data['chats']:
-            return []
-        return [int(chat_id) for chat_id in self.data['chats']['groups'].keys()]
+        """Get all group chat IDs for broadcasting (cached; callers only read)"""
+        return self._group_chat_ids
 
-    def get_statistics(self) -> Dict[str, Any]:
-        """Get bot usage statistics"""
-        # Count users from both main data (who asked questions) and chats.users (who started bot)
-        users_with_questions = set([k for k in self.data.keys() if k != 'chats'])
-        users_in_chats = set(self.data.get('chats', {}).get('users', {}).keys())
-        all_users = users_with_questions | users_in_chats  # Union of both sets
-        total_users = len(all_users)
+    def remove_chat(self, chat_id: int):
+        """Forget a chat that blocked or removed the bot.
 
-        total_questions = sum(user.get('total_questions', 0) for user in self.data.values() if isinstance(user, dict) and 'total_questions' in user)
+        Future broadcasts skip it instead of paying a failed round-trip
+        forever; the edit log records a tombstone so the removal survives a
+        restart.
+        """
+        chat_id_str = str(chat_id)
+        chats = self.data.get('chats', {})
+        if chat_id_str in chats.get('users', {}):
+            del chats['users'][chat_id_str]
+            self._user_ids.discard(chat_id_str)
+            try:
+                self._user_chat_ids.remove(chat_id)
+            except ValueError:
+                pass
+            self._log_chat_change('users', chat_id_str)
+        if chat_id_str in chats.get('groups', {}):
+            del chats['groups'][chat_id_str]
+            try:
+                self._group_chat_ids.remove(chat_id)
+            except ValueError:
+                pass
+            self._log_chat_change('groups', chat_id_str)
+        self._all_chat_ids = None
+        self._chat_seen_ord.pop(chat_id_str, None)
+        logger.info("[CHATS] Removed unreachable chat %s from broadcast lists", chat_id)
+
+    def get_broadcast_targets(self, target: str) -> List[int]:
+        """Get chat IDs for a broadcast target: 'users', 'groups' or 'all'.
+
+        The 'all' list is deduplicated (a chat tracked as both user and group
+        is messaged once) and cached until a new chat is tracked.
+        """
+        if target == 'users':
+            return self._user_chat_ids
+        if target == 'groups':
+            return self._group_chat_ids
+        if self._all_chat_ids is None:
+            # dict.fromkeys dedups while preserving insertion order
+            self._all_chat_ids = list(dict.fromkeys(self._user_chat_ids + self._group_chat_ids))
+        return self._all_chat_ids
 
+    def get_statistics(self) -> Dict[str, Any]:
+        """Get bot usage statistics"""
+        # Counters are maintained incrementally, so this is O(1)
         user_chats = len(self.data.get('chats', {}).get('users', {}))
         group_chats = len(self.data.get('chats', {}).get('groups', {}))
 
         return {
-            'total_users': total_users,
-            'total_questions': total_questions,
+            'total_users': len(self._user_ids),
+            'total_questions': self._total_questions,
             'user_chats': user_chats,
             'group_chats': group_chats,
             'total_chats': user_chats + group_chats
@@ -546,10 +1025,228 @@ class UserUsageTracker:
 usage_tracker = UserUsageTracker()
 
 
+# ============================================================================
+# Static Message Constants
+# ============================================================================
+# These messages only depend on module-level constants, so build them once at
+# import time instead of re-concatenating the f-strings on every invocation.
+
+WELCOME_MESSAGE = (
+    "🤖 Welcome to NovaAiBot!\n\n"
+    "I'm here to answer your questions using advanced AI technology.\n\n"
+    "📝 How to use:\n"
+    "• Send me text questions directly\n"
+    "• Send photos of problems, diagrams, or equations\n"
+    "• Add a caption to photos for specific questions\n"
+    "• You start with 10 FREE credits\n\n"
+    "🎯 Perfect for:\n"
+    "• Physics problems with diagrams\n"
+    "• Chemistry equations and structures\n"
+    "• Biology diagrams and illustrations\n"
+    "• Math equations from textbooks\n\n"
+    "💡 Want unlimited access?\n"
+    f"Download Nova Learn App: {NOVA_LEARN_APP_LINK}\n\n"
+    f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}\n\n"
+    "Send me a question or photo to get started!"
+)
+
+HELP_MESSAGE = (
+    "🆘 NovaAiBot Help\n\n"
+    "**Commands:**\n"
+    "/start - Start the bot\n"
+    "/help - Show this help message\n"
+    "/status - Check your credit balance\n"
+    "/credits - View available credit packages\n"
+    "/buy - Purchase credits with Telegram Stars ⭐\n"
+    "/keyboard - Show quick-access buttons\n\n"
+    "**How to Ask Questions:**\n\n"
+    "📝 Text Questions:\n"
+    "Just type and send your question\n\n"
+    "📸 Image Questions:\n"
+    "1. Take a photo of your problem/diagram\n"
+    "2. Add a caption (optional but recommended)\n"
+    "3. Send it to the bot\n\n"
+    "**Examples:**\n"
+    "• Photo of physics problem + caption: \"Solve this\"\n"
+    "• Photo of chemical structure + caption: \"What compound is this?\"\n"
+    "• Photo of biology diagram + caption: \"Explain this process\"\n"
+    "• Photo without caption: Bot will analyze and explain\n\n"
+    "**Credit System:**\n"
+    f"• Text question: {UserUsageTracker.TEXT_QUESTION_COST} credit\n"
+    f"• Image question: {UserUsageTracker.IMAGE_QUESTION_COST} credits\n"
+    f"• New users start with {UserUsageTracker.INITIAL_CREDITS} free credits\n"
+    f"• Daily limit: {UserUsageTracker.DAILY_CREDIT_LIMIT} credits per day\n"
+    "• Images must be under 5MB and clear\n"
+    "• Buy more credits with /buy using Telegram Stars ⭐\n\n"
+    f"📱 For unlimited access, download: {NOVA_LEARN_APP_LINK}\n"
+    f"📢 Join our WhatsApp: {WHATSAPP_CHANNEL_LINK}"
+)
+
+HELP_MESSAGE_OWNER = HELP_MESSAGE + (
+    "\n\n"
+    "👑 **Owner Commands** (Private Chat Only):\n"
+    "/settings - Bot settings & statistics\n"
+    "/broadcast - Send messages to users/groups\n"
+    "/addcredits - Add credits to users\n"
+    "/setcredits - Set user credits\n"
+    "/setad - Configure basic advertisement\n"
+    "/togglead - Enable/disable basic ads\n\n"
+    "📅 **Scheduled Ads:**\n"
+    "/createad - Create scheduled advertisement\n"
+    "/listads - View all scheduled ads\n"
+    "/pausead <id> - Pause an ad\n"
+    "/resumead <id> - Resume an ad\n"
+    "/deletead <id> - Delete an ad\n\n"
+    "💡 Use keyboard buttons for quick access!"
+)
+
+# Shared upsell block for the out-of-credits / daily-limit messages
+_LIMIT_UPSELL = (
+    "Get:\n"
+    "✨ Unlimited AI-powered answers\n"
+    "✨ Advanced learning features\n"
+    "✨ Personalized study plans\n"
+    "✨ And much more!\n\n"
+    f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
+)
+
+# Only the usage numbers vary per call; fill with .format(daily_usage=...,
+# daily_limit=...)
+DAILY_LIMIT_MESSAGE_TEMPLATE = (
+    "⏰ **Daily Limit Reached!**\n\n"
+    "📊 You've used **{daily_usage}/{daily_limit} credits** today.\n"
+    "⏱️ Your limit will reset tomorrow.\n\n"
+    "💡 **Why daily limits?**\n"
+    "To ensure fair usage for all users.\n\n"
+    f"📱 Want unlimited access? Download Nova Learn App:\n{NOVA_LEARN_APP_LINK}\n\n"
+    + _LIMIT_UPSELL
+)
+
+INSUFFICIENT_CREDITS_TEXT_TEMPLATE = (
+    "⚠️ **Insufficient Credits!**\n\n"
+    "💰 Your Balance: **{credits} credits**\n"
+    f"💳 Required: **{UserUsageTracker.TEXT_QUESTION_COST} credit**\n"
+    "📊 Daily Usage: **{daily_usage}/{daily_limit} credits**\n\n"
+    "🚀 Get more credits:\n\n"
+    "Use /credits to see available packages\n\n"
+    f"📱 Or download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
+    + _LIMIT_UPSELL
+)
+
+INSUFFICIENT_CREDITS_PHOTO_TEMPLATE = (
+    "⚠️ **Insufficient Credits!**\n\n"
+    "💰 Your Balance: **{credits} credits**\n"
+    f"💳 Required: **{UserUsageTracker.IMAGE_QUESTION_COST} credits**\n"
+    "📊 Daily Usage: **{daily_usage}/{daily_limit} credits**\n\n"
+    "📸 Image questions cost more due to higher processing requirements.\n\n"
+    "🚀 Get more credits:\n\n"
+    "Use /credits to see available packages\n\n"
+    f"📱 Or download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
+    + _LIMIT_UPSELL
+)
+
+ERROR_MESSAGE_TEXT = (
+    "❌ Sorry, I encountered an error processing your question.\n\n"
+    "This could be due to:\n"
+    "• High server load\n"
+    "• Complex question requiring more processing\n"
+    "• Temporary API issues\n\n"
+    "Please try:\n"
+    "• Simplifying your question\n"
+    "• Trying again in a few moments\n\n"
+    f"📱 For unlimited access and priority support:\n{NOVA_LEARN_APP_LINK}\n\n"
+    f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}"
+)
+
+LINKS_MESSAGE = (
+    "🔗 <b>NovaAI Links</b>\n\n"
+    "📱 <b>Nova Learn App</b> (Unlimited Access):\n"
+    f"{NOVA_LEARN_APP_LINK}\n\n"
+    "📢 <b>WhatsApp Channel</b> (Updates & Support):\n"
+    f"{WHATSAPP_CHANNEL_LINK}\n\n"
+    "💡 <b>Join our community</b> for:\n"
+    "• Latest updates and features\n"
+    "• Study tips and resources\n"
+    "• Special offers and promotions\n"
+    "• 24/7 community support"
+)
+
+# Credit-package derived objects. The package table is immutable, so the
+# message fragments, the selection keyboard and the invoice prices can all be
+# built once instead of per /credits / /buy interaction.
+CREDIT_PACKAGE_LINES = ''.join(
+    f"⭐ <b>{p['name']}</b>: {p['credits']} credits - {p['stars']} Stars\n"
+    for p in UserUsageTracker.CREDIT_PACKAGES.values()
+)
+
+CREDIT_PACKAGE_DETAILS = ''.join(
+    f"⭐ <b>{p['name']}</b> - {p['stars']} Stars\n"
+    f"   • {p['credits']} credits - {p['description']}\n\n"
+    for p in UserUsageTracker.CREDIT_PACKAGES.values()
+)
+
+BUY_PACKAGE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"⭐ {p['name']} - {p['stars']} Stars", callback_data=f"buy_{pid}")]
+    for pid, p in UserUsageTracker.CREDIT_PACKAGES.items()
+])
+
+PACKAGE_INVOICE_PRICES = {
+    pid: [LabeledPrice(label=p['name'], amount=p['stars'])]
+    for pid, p in UserUsageTracker.CREDIT_PACKAGES.items()
+}
+
+ERROR_MESSAGE_PHOTO = (
+    "❌ Sorry, I encountered an error processing your image.\n\n"
+    "This could be due to:\n"
+    "• Image format not supported\n"
+    "• High server load\n"
+    "• Complex image requiring more processing\n"
+    "• Temporary API issues\n\n"
+    "Please try:\n"
+    "• Using a clearer image\n"
+    "• Adding a text caption describing what you need help with\n"
+    "• Trying again in a few moments\n\n"
+    f"📱 For unlimited access and priority support:\n{NOVA_LEARN_APP_LINK}\n\n"
+    f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}"
+)
+
+
 # ============================================================================
 # LaTeX Formatting Utilities for Telegram
 # ============================================================================
 
+# Precompiled math-delimiter scanner: one combined pass over the text instead
+# of four separate re.sub calls that each recompiled their pattern
+_RE_MATH = re.compile(
+    r'\$\$\s*(.*?)\s*\$\$'        # display math: $$...$$
+    r'|\\\[\s*(.*?)\s*\\\]'       # display math: \[...\]
+    r'|\$([^\$]+?)\$'             # inline math: $...$
+    r'|\\\(\s*(.*?)\s*\\\)',      # inline math: \(...\)
+    re.DOTALL
+)
+
+
+def _convert_math_match(match) -> str:
+    """Convert one matched math expression to plain Unicode text"""
+    display1, display2, inline1, inline2 = match.groups()
+    if display1 is not None or display2 is not None:
+        # Display math gets its own lines
+        latex = display1 if display1 is not None else display2
+        return f"\n{latex_to_unicode(latex.strip())}\n"
+    latex = inline1 if inline1 is not None else inline2
+    return latex_to_unicode(latex.strip())
+
+
+# Responses above this size bypass the memoization caches so a few huge
+# answers can't pin megabytes of cached strings
+_POSTPROCESS_CACHE_MAX_LEN = 32_000
+
+
+@lru_cache(maxsize=2048)
+def _convert_latex_cached(text: str) -> str:
+    return _RE_MATH.sub(_convert_math_match, text)
+
+
 def convert_latex_to_telegram(text: str) -> str:
     """
     Convert LaTeX math notation to Telegram-compatible format.
@@ -557,138 +1254,157 @@ def convert_latex_to_telegram(text: str) -> str:
 
     Telegram's LaTeX support is unreliable, especially with non-Latin scripts.
     So we convert common LaTeX to readable Unicode text.
+
+    Results are memoized, so a retransmitted response (retry, re-render)
+    skips the regex work entirely.
     """
     if not text:
         return text
 
-    result = text
+    # Most outbound messages (menus, errors, captions) contain no math at
+    # all; every _RE_MATH alternative starts with '$' or '\', so two C-level
+    # substring checks skip the regex scan entirely
+    if '$' not in text and '\\' not in text:
+        return text
 
-    # First, extract and convert LaTeX expressions to plain Unicode
+    # Extract and convert LaTeX expressions to plain Unicode in a single scan
     # This is more reliable than Telegram's LaTeX renderer
+    if len(text) > _POSTPROCESS_CACHE_MAX_LEN:
+        return _RE_MATH.sub(_convert_math_match, text)
+    return _convert_latex_cached(text)
+
+
+# Whitespace collapser for math expressions
+_RE_WS = re.compile(r'\s+')
+
+# LaTeX -> Unicode rules, compiled once at import. latex_to_unicode used to
+# rebuild this table and recompile every pattern on each AI response.
+# Structural rules (the ones with capture groups) run before the fused
+# symbol pass; brace cleanup runs after it.
+_LATEX_STRUCTURAL_PRE = tuple((re.compile(pattern), replacement) for pattern, replacement in [
+    # Fractions - convert \frac{a}{b} to (a/b) or a/b
+    (r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1/\2)'),
+    (r'\\dfrac\{([^}]+)\}\{([^}]+)\}', r'(\1/\2)'),
+    (r'\\tfrac\{([^}]+)\}\{([^}]+)\}', r'(\1/\2)'),
+
+    # Square roots
+    (r'\\sqrt\{([^}]+)\}', r'√(\1)'),
+    (r'\\sqrt\[3\]\{([^}]+)\}', r'∛(\1)'),
+])
+
+_LATEX_STRUCTURAL_POST = tuple((re.compile(pattern), replacement) for pattern, replacement in [
+    # Remove \mathrm, \text commands but keep content
+    (r'\\mathrm\{([^}]+)\}', r'\1'),
+    (r'\\text\{([^}]+)\}', r'\1'),
+
+    # Clean up curly braces used for grouping
+    (r'\{', ''),
+    (r'\}', ''),
+])
+
+# Every fixed-string LaTeX token (Greek letters, operators, spacing, \left
+# and \right) fused into one alternation: a single scan replaces what used
+# to be ~30 sequential full-string re.sub passes
+_SYMBOL_MAP = {
+    # Greek letters
+    'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'Delta': 'Δ',
+    'epsilon': 'ε', 'theta': 'θ', 'lambda': 'λ', 'mu': 'μ', 'pi': 'π',
+    'sigma': 'σ', 'tau': 'τ', 'phi': 'φ', 'omega': 'ω', 'Omega': 'Ω',
+    # Operators
+    'times': '×', 'div': '÷', 'pm': '±', 'leq': '≤', 'geq': '≥',
+    'neq': '≠', 'approx': '≈', 'infty': '∞', 'sum': '∑', 'prod': '∏',
+    'int': '∫',
+    # Spacing commands
+    ',': ' ', ';': ' ', 'quad': '  ', 'qquad': '    ',
+    # \left / \right are purely visual
+    'left': '', 'right': '',
+}
+# Longest-first so e.g. 'infty' wins over any shorter token it shares a
+# prefix with
+_SYMBOL_RE = re.compile(
+    r'\\(' + '|'.join(sorted(map(re.escape, _SYMBOL_MAP), key=len, reverse=True)) + r')'
+)
+
+
+def _convert_symbol(match) -> str:
+    return _SYMBOL_MAP[match.group(1)]
+
+# Superscripts x^2 -> x² and subscripts H_2 -> H₂
+_RE_SUPERSCRIPT = re.compile(r'([A-Za-z0-9])\^([0-9n+-])')
+_RE_SUBSCRIPT = re.compile(r'([A-Za-z])_([0-9])')
+
+# str.translate tables; the regexes above only capture characters these
+# tables cover, so no membership check is needed in the callbacks
+_SUPER_TABLE = str.maketrans('0123456789+-n', '⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻ⁿ')
+_SUB_TABLE = str.maketrans('0123456789', '₀₁₂₃₄₅₆₇₈₉')
 
-    # Handle display math blocks $$...$$ and \[...\]
-    def convert_display_math(match):
-        latex = match.group(1).strip()
-        # Convert to plain text representation
-        plain = latex_to_unicode(latex)
-        return f"\n{plain}\n"
 
-    result = re.sub(r'\$\$\s*(.*?)\s*\$\$', convert_display_math, result, flags=re.DOTALL)
-    result = re.sub(r'\\\[\s*(.*?)\s*\\\]', convert_display_math, result, flags=re.DOTALL)
+def _convert_superscript(match):
+    return match.group(1) + match.group(2).translate(_SUPER_TABLE)
 
-    # Handle inline math $...$ and \(...\)
-    def convert_inline_math(match):
-        latex = match.group(1).strip()
-        # Convert to plain text representation
-        plain = latex_to_unicode(latex)
-        return plain
 
-    result = re.sub(r'\$([^\$]+?)\$', convert_inline_math, result)
-    result = re.sub(r'\\\(\s*(.*?)\s*\\\)', convert_inline_math, result)
+def _convert_subscript(match):
+    return match.group(1) + match.group(2).translate(_SUB_TABLE)
 
-    return result
+
+@lru_cache(maxsize=2048)
+def _latex_to_unicode_cached(latex: str) -> str:
+    # Remove extra spaces
+    text = _RE_WS.sub(' ', latex.strip())
+
+    # No command, script or brace characters means every pass below is a
+    # no-op - return the collapsed text as-is
+    if ('\\' not in text and '^' not in text and '_' not in text
+            and '{' not in text and '}' not in text):
+        return text
+
+    # Fractions and roots first, then all fixed tokens in one scan, then
+    # \text/\mathrm unwrapping and brace cleanup
+    for rx, replacement in _LATEX_STRUCTURAL_PRE:
+        text = rx.sub(replacement, text)
+
+    text = _SYMBOL_RE.sub(_convert_symbol, text)
+
+    for rx, replacement in _LATEX_STRUCTURAL_POST:
+        text = rx.sub(replacement, text)
+
+    text = _RE_SUPERSCRIPT.sub(_convert_superscript, text)
+    text = _RE_SUBSCRIPT.sub(_convert_subscript, text)
+
+    return text
 
 
 def latex_to_unicode(latex: str) -> str:
     """
     Convert common LaTeX expressions to Unicode plain text.
     This works better in Telegram than LaTeX rendering.
-    """
-    # Remove extra spaces
-    text = re.sub(r'\s+', ' ', latex.strip())
-
-    # Common LaTeX commands to Unicode
-    replacements = {
-        # Fractions - convert \frac{a}{b} to (a/b) or a/b
-        r'\\frac\{([^}]+)\}\{([^}]+)\}': r'(\1/\2)',
-        r'\\dfrac\{([^}]+)\}\{([^}]+)\}': r'(\1/\2)',
-        r'\\tfrac\{([^}]+)\}\{([^}]+)\}': r'(\1/\2)',
-
-        # Square roots
-        r'\\sqrt\{([^}]+)\}': r'√(\1)',
-        r'\\sqrt\[3\]\{([^}]+)\}': r'∛(\1)',
-
-        # Greek letters
-        r'\\alpha': 'α',
-        r'\\beta': 'β',
-        r'\\gamma': 'γ',
-        r'\\delta': 'δ',
-        r'\\Delta': 'Δ',
-        r'\\epsilon': 'ε',
-        r'\\theta': 'θ',
-        r'\\lambda': 'λ',
-        r'\\mu': 'μ',
-        r'\\pi': 'π',
-        r'\\sigma': 'σ',
-        r'\\tau': 'τ',
-        r'\\phi': 'φ',
-        r'\\omega': 'ω',
-        r'\\Omega': 'Ω',
-
-        # Operators
-        r'\\times': '×',
-        r'\\div': '÷',
-        r'\\pm': '±',
-        r'\\leq': '≤',
-        r'\\geq': '≥',
-        r'\\neq': '≠',
-        r'\\approx': '≈',
-        r'\\infty': '∞',
-        r'\\sum': '∑',
-        r'\\prod': '∏',
-        r'\\int': '∫',
-
-        # Remove \mathrm, \text commands but keep content
-        r'\\mathrm\{([^}]+)\}': r'\1',
-        r'\\text\{([^}]+)\}': r'\1',
-
-        # Remove spacing commands
-        r'\\,': ' ',
-        r'\\;': ' ',
-        r'\\quad': '  ',
-        r'\\qquad': '    ',
-
-        # Remove \left and \right
-        r'\\left': '',
-        r'\\right': '',
-
-        # Clean up curly braces used for grouping
-        r'\{': '',
-        r'\}': '',
-    }
-
-    # Apply replacements
-    for pattern, replacement in replacements.items():
-        text = re.sub(pattern, replacement, text)
 
-    # Handle superscripts x^2 -> x²
-    superscripts = {'0': '⁰', '1': '¹', '2': '²', '3': '³', '4': '⁴',
-                    '5': '⁵', '6': '⁶', '7': '⁷', '8': '⁸', '9': '⁹',
-                    '+': '⁺', '-': '⁻', 'n': 'ⁿ'}
-
-    def convert_superscript(match):
-        base = match.group(1)
-        exp = match.group(2)
-        if len(exp) == 1 and exp in superscripts:
-            return base + superscripts[exp]
-        return f"{base}^{exp}"
+    Individual math fragments repeat heavily across answers (units, H_2O,
+    E=mc^2), so results are memoized; oversized fragments bypass the cache.
+    """
+    if not latex:
+        return latex
+    if len(latex) > _POSTPROCESS_CACHE_MAX_LEN:
+        return _latex_to_unicode_cached.__wrapped__(latex)
+    return _latex_to_unicode_cached(latex)
 
-    text = re.sub(r'([A-Za-z0-9])\^([0-9n+-])', convert_superscript, text)
 
-    # Handle subscripts H_2 -> H₂
-    subscripts = {'0': '₀', '1': '₁', '2': '₂', '3': '₃', '4': '₄',
-                  '5': '₅', '6': '₆', '7': '₇', '8': '₈', '9': '₉'}
+# Maps every MarkdownV2 special character to its escaped form; str.translate
+# runs as a tight C loop over the codepoints with no regex-engine overhead
+_MD2_TRANS = str.maketrans({c: '\\' + c for c in r'_*[]()~`>#+=|{}.!-'})
 
-    def convert_subscript(match):
-        base = match.group(1)
-        sub = match.group(2)
-        if len(sub) == 1 and sub in subscripts:
-            return base + subscripts[sub]
-        return f"{base}_{sub}"
+# Splits text into alternating plain/LaTeX-math runs in one pass, so math
+# spans can be kept verbatim without placeholder round trips
+_MD2_MATH_SPLIT = re.compile(r'(\\\[.*?\\\]|\\\(.*?\\\))', re.DOTALL)
 
-    text = re.sub(r'([A-Za-z])_([0-9])', convert_subscript, text)
 
-    return text
+@lru_cache(maxsize=2048)
+def _escape_markdown_v2_cached(text: str) -> str:
+    # split() yields plain runs at even indices and math spans at odd ones
+    parts = _MD2_MATH_SPLIT.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].translate(_MD2_TRANS)
+    return ''.join(parts)
 
 
 def escape_markdown_v2(text: str) -> str:
@@ -696,27 +1412,32 @@ def escape_markdown_v2(text: str) -> str:
     Escape special characters for Telegram MarkdownV2.
     Must escape: _ * [ ] ( ) ~ ` > # + - = | { } . !
 
-    Since we're using Unicode text instead of LaTeX, we escape all special characters.
+    LaTeX math spans (\\[...\\] and \\(...\\)) are passed through verbatim;
+    everything else is escaped with a single translate pass. Results for
+    reasonably sized strings are memoized.
     """
     if not text:
         return text
 
-    # Escape special MarkdownV2 characters
-    # Note: We need to escape these in the correct order to avoid double-escaping
-    special_chars = r'_*[]()~`>#+=|{}.!-'
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
+    if '\\' not in text:
+        # Fast path: no math delimiters possible, translate the whole string
+        return text.translate(_MD2_TRANS)
 
-    return text
+    if len(text) > _POSTPROCESS_CACHE_MAX_LEN:
+        parts = _MD2_MATH_SPLIT.split(text)
+        for i in range(0, len(parts), 2):
+            parts[i] = parts[i].translate(_MD2_TRANS)
+        return ''.join(parts)
+    return _escape_markdown_v2_cached(text)
 
 
 # ============================================================================
 # AI System Prompts
 # ============================================================================
 
-def get_default_system_prompt() -> str:
-    """Default system prompt for Nova AI Teacher"""
-    return """You are NOVA AI Teacher, an expert tutor for Sri Lankan Advanced Level (A/L) Science students.
+# Built once at import - the prompt is a constant and used to be re-evaluated
+# and re-concatenated on every AI call
+_SYSTEM_PROMPT = """You are NOVA AI Teacher, an expert tutor for Sri Lankan Advanced Level (A/L) Science students.
 Your role is to help students with Physics, Chemistry, and Biology questions.
 
 Guidelines:
@@ -766,11 +1487,39 @@ Guidelines:
 
 Remember: You are a helpful, patient, and encouraging teacher for Sri Lankan A/L students."""
 
+# Precomposed prompt prefixes so each API call does a single concatenation
+
+
+def get_default_system_prompt() -> str:
+    """Default system prompt for Nova AI Teacher"""
+    return _SYSTEM_PROMPT
+
 
 # ============================================================================
 # Image Processing Utilities
 # ============================================================================
 
+# Vision models downscale internally to roughly this size anyway, so sending
+# larger images only wastes bandwidth, tokens, and encode time
+IMAGE_MAX_DIMENSION = 1024
+IMAGE_JPEG_QUALITY = 85
+
+
+def _downscale_image(image_bytes: bytearray) -> bytes:
+    """Resize an image to IMAGE_MAX_DIMENSION and re-encode as JPEG (blocking)"""
+    im = Image.open(io.BytesIO(image_bytes))
+    im.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.convert('RGB').save(buf, 'JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+# Processed photos keyed by file_unique_id, LRU-evicted. Retried or
+# forwarded images skip the Telegram download and base64 re-encode.
+_photo_cache: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_PHOTO_CACHE_MAX = 512
+
+
 async def process_telegram_photo(photo: PhotoSize, context: ContextTypes.DEFAULT_TYPE) -> Tuple[str, str]:
     """
     Download and process a Telegram photo
@@ -778,7 +1527,18 @@ async def process_telegram_photo(photo: PhotoSize, context: ContextTypes.DEFAULT
     """
     MAX_SIZE_BYTES = 5 * 1024 * 1024  # 5MB limit
 
+    cached = _photo_cache.get(photo.file_unique_id)
+    if cached is not None:
+        _photo_cache.move_to_end(photo.file_unique_id)
+        logger.info("[IMG] Reusing processed image for file %s", photo.file_unique_id)
+        return cached
+
     try:
+        # Reject oversized photos before the get_file round-trip; Telegram
+        # reports the size on the PhotoSize itself
+        if photo.file_size and photo.file_size > MAX_SIZE_BYTES:
+            raise ValueError(f"Image too large: {photo.file_size} bytes (max {MAX_SIZE_BYTES})")
+
         # Get the file
         file = await context.bot.get_file(photo.file_id)
 
@@ -788,14 +1548,30 @@ async def process_telegram_photo(photo: PhotoSize, context: ContextTypes.DEFAULT
 
         # Download to bytes
         byte_array = await file.download_as_bytearray()
+        original_size = len(byte_array)
+
+        # Downscale before encoding - typically shrinks the payload 5-20x.
+        # Runs in a thread so the resize doesn't block the event loop.
+        if Image is not None:
+            try:
+                byte_array = await asyncio.to_thread(_downscale_image, byte_array)
+            except Exception as e:
+                logger.warning(f"[IMG] Downscale failed, sending original: {e}")
 
-        # Convert to base64
-        base64_image = base64.b64encode(bytes(byte_array)).decode('utf-8')
+        # Convert to base64. b64encode accepts the bytearray directly (no
+        # bytes() copy) and base64 output is pure ASCII, so use the faster
+        # ascii decoder - together that avoids two image-sized allocations.
+        base64_image = base64.b64encode(byte_array).decode('ascii')
 
-        # Determine MIME type (Telegram photos are usually JPEG)
+        # Determine MIME type (Telegram photos are usually JPEG, and the
+        # downscale step re-encodes to JPEG)
         mime_type = "image/jpeg"
 
-        logger.info(f"[IMG] Processed image: {len(base64_image)} chars, size: {file.file_size} bytes")
+        logger.info("[IMG] Processed image: %s chars, original size: %s bytes", len(base64_image), original_size)
+
+        _photo_cache[photo.file_unique_id] = (base64_image, mime_type)
+        if len(_photo_cache) > _PHOTO_CACHE_MAX:
+            _photo_cache.popitem(last=False)
 
         return base64_image, mime_type
 
@@ -808,12 +1584,100 @@ async def process_telegram_photo(photo: PhotoSize, context: ContextTypes.DEFAULT
 # AI API Helper Functions
 # ============================================================================
 
-async def with_timeout(coro, timeout_seconds: float, label: str):
-    """Add timeout to async operation"""
-    try:
-        return await asyncio.wait_for(coro, timeout=timeout_seconds)
-    except asyncio.TimeoutError:
-        raise Exception(f"{label}_TIMEOUT")
+# Shared aiohttp session - creating one per call redoes DNS lookup, TCP and
+# TLS handshakes for every AI request
+_http_session = None
+
+
+async def get_http_session():
+    """Return the shared aiohttp ClientSession, creating it lazily"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """Close the shared aiohttp ClientSession (used on shutdown)"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def _json_body(payload: dict) -> bytes:
+    """Serialize an API request body to bytes, using orjson when available.
+
+    aiohttp's json= kwarg goes through stdlib json.dumps, which is the slow
+    path once request bodies carry multi-megabyte base64 images.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+# Retry/timeout policy for provider calls. connect bounds TCP+TLS setup and
+# sock_read bounds a stalled body read, so a hung socket fails fast instead of
+# pinning the request until the total timeout expires.
+API_CONNECT_TIMEOUT = 10
+API_RETRY_ATTEMPTS = 3
+API_RETRY_BACKOFF_BASE = 1.0  # seconds, doubled per attempt with jitter
+
+# Continuation calls and the overall budget for one answer; overridable so a
+# runaway continuation loop can't burn unbounded tokens
+OPENAI_CONTINUATION_MAX_TOKENS = int(os.getenv('OPENAI_CONTINUATION_MAX_TOKENS', '2000'))
+OPENAI_TOTAL_TOKENS_CEILING = int(os.getenv('OPENAI_TOTAL_TOKENS_CEILING', '20000'))
+
+# Output cap for the fallback providers (Claude, Gemini)
+FALLBACK_MAX_OUTPUT_TOKENS = 2000
+
+
+async def _post_json(url: str, headers: dict, payload: dict,
+                     timeout_seconds: float, label: str) -> dict:
+    """POST a JSON body and decode the JSON response, with bounded retries.
+
+    Transient failures (connection errors, timeouts) are retried with
+    jittered exponential backoff, but the retries share one deadline: the
+    call never takes longer than timeout_seconds in total, so the hedged
+    provider race above it keeps its timing guarantees. Timeouts surface as
+    "<label>_TIMEOUT" like the old with_timeout wrapper did.
+    """
+    body = _json_body(payload)
+    deadline = time.monotonic() + timeout_seconds
+    last_error: Optional[BaseException] = None
+
+    for attempt in range(API_RETRY_ATTEMPTS):
+        if attempt:
+            delay = API_RETRY_BACKOFF_BASE * (2 ** (attempt - 1)) * (1 + random.random())
+            if time.monotonic() + delay >= deadline:
+                break
+            logger.warning("[AI] %s attempt %s failed (%s), retrying in %.1fs",
+                           label, attempt, last_error, delay)
+            await asyncio.sleep(delay)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = aiohttp.ClientTimeout(
+            total=remaining,
+            connect=min(API_CONNECT_TIMEOUT, remaining),
+            sock_read=remaining,
+        )
+        try:
+            session = await get_http_session()
+            async with session.post(url, headers=headers, data=body, timeout=timeout) as response:
+                # response.json() parses with stdlib json; read the bytes and
+                # decode with orjson instead (same fast path as the encoder)
+                raw = await response.read()
+                return orjson.loads(raw) if orjson is not None else json.loads(raw)
+        except asyncio.TimeoutError:
+            last_error = Exception(f"{label}_TIMEOUT")
+        except aiohttp.ClientError as e:
+            last_error = e
+
+    raise last_error if last_error is not None else Exception(f"{label}_TIMEOUT")
 
 
 async def call_openai_responses_api(
@@ -828,8 +1692,6 @@ async def call_openai_responses_api(
     Returns: (response_text, metadata)
     image_data: Optional tuple of (base64_image, mime_type)
     """
-    import aiohttp
-
     # Build request body based on whether we have an image
     if image_data:
         base64_image, mime_type = image_data
@@ -842,7 +1704,7 @@ async def call_openai_responses_api(
                     "content": [
                         {
                             "type": "input_text",
-                            "text": f"{get_default_system_prompt()}\n\nUser message: {message}"
+                            "text": message
                         },
                         {
                             "type": "input_image",
@@ -851,6 +1713,7 @@ async def call_openai_responses_api(
                     ]
                 }
             ],
+            "instructions": _SYSTEM_PROMPT,
             "reasoning": {"effort": "medium"},  # Higher effort for image analysis
             "text": {"verbosity": "medium"},
             "truncation": "disabled",
@@ -861,7 +1724,8 @@ async def call_openai_responses_api(
         # Text-only request
         request_body = {
             "model": model,
-            "input": f"{get_default_system_prompt()}\n\nUser message: {message}",
+            "input": message,
+            "instructions": _SYSTEM_PROMPT,
             "reasoning": {"effort": "minimal"},
             "text": {"verbosity": "low"},
             "truncation": "disabled",
@@ -869,19 +1733,14 @@ async def call_openai_responses_api(
             "store": False,
         }
 
-    async def make_request():
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.openai.com/v1/responses',
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {OPENAI_API_KEY}',
-                },
-                json=request_body
-            ) as response:
-                return await response.json()
-
-    result = await with_timeout(make_request(), timeout_seconds, 'OPENAI')
+    openai_headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {OPENAI_API_KEY}',
+    }
+    result = await _post_json(
+        'https://api.openai.com/v1/responses',
+        openai_headers, request_body, timeout_seconds, 'OPENAI'
+    )
 
     # Extract text from response
     response_text = extract_text_from_openai_response(result)
@@ -894,31 +1753,29 @@ async def call_openai_responses_api(
     continuation_attempts = 0
     max_continuations = 5
 
+    # Only previous_response_id changes between continuation calls, so build
+    # the body once and patch that field per iteration
+    continue_body = {
+        "model": model,
+        "previous_response_id": None,
+        "max_output_tokens": OPENAI_CONTINUATION_MAX_TOKENS,
+        "truncation": "disabled",
+        "store": False,
+    }
+
     while (status == 'incomplete' and last_id and continuation_attempts < max_continuations):
+        if total_tokens >= OPENAI_TOTAL_TOKENS_CEILING:
+            logger.warning("[AI] Token ceiling reached (%s), stopping continuations", total_tokens)
+            break
         continuation_attempts += 1
         logger.info(f"[AI] Continuation attempt {continuation_attempts}/{max_continuations}")
 
-        continue_body = {
-            "model": model,
-            "previous_response_id": last_id,
-            "max_output_tokens": 2000,
-            "truncation": "disabled",
-            "store": False,
-        }
+        continue_body["previous_response_id"] = last_id
 
-        async def continue_request():
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    'https://api.openai.com/v1/responses',
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {OPENAI_API_KEY}',
-                    },
-                    json=continue_body
-                ) as response:
-                    return await response.json()
-
-        cont_result = await with_timeout(continue_request(), timeout_seconds, 'OPENAI')
+        cont_result = await _post_json(
+            'https://api.openai.com/v1/responses',
+            openai_headers, continue_body, timeout_seconds, 'OPENAI'
+        )
 
         cont_text = extract_text_from_openai_response(cont_result)
         if cont_text:
@@ -939,16 +1796,21 @@ async def call_openai_responses_api(
 
 def extract_text_from_openai_response(resp: dict) -> str:
     """Extract plain text from OpenAI Responses API structure"""
-    if isinstance(resp.get('output_text'), str) and resp['output_text'].strip():
-        return resp['output_text']
-
-    if isinstance(resp.get('output'), list):
-        text = ''
-        for item in resp['output']:
-            if item.get('type') == 'message' and isinstance(item.get('content'), list):
-                for content_item in item['content']:
-                    if content_item.get('type') == 'output_text':
-                        text += content_item.get('text', '')
+    output_text = resp.get('output_text')
+    if isinstance(output_text, str) and output_text.strip():
+        return output_text
+
+    output = resp.get('output')
+    if isinstance(output, list):
+        # join() over a generator instead of += so an 8k-token answer isn't
+        # reallocated once per content item
+        text = ''.join(
+            content_item.get('text', '')
+            for item in output
+            if item.get('type') == 'message' and isinstance(item.get('content'), list)
+            for content_item in item['content']
+            if content_item.get('type') == 'output_text'
+        )
         if text.strip():
             return text
 
@@ -964,8 +1826,6 @@ async def call_claude_api(
     image_data: Optional[Tuple[str, str]] = None
 ) -> tuple[str, dict]:
     """Call Anthropic Claude API with optional vision support"""
-    import aiohttp
-
     if not CLAUDE_API_KEY:
         raise Exception("CLAUDE_API_KEY not configured")
 
@@ -976,7 +1836,7 @@ async def call_claude_api(
         content = [
             {
                 "type": "text",
-                "text": f"{get_default_system_prompt()}\n\nUser message:\n{message}"
+                "text": message
             },
             {
                 "type": "image",
@@ -988,11 +1848,12 @@ async def call_claude_api(
             }
         ]
     else:
-        content = f"{get_default_system_prompt()}\n\nUser message:\n{message}"
+        content = message
 
     request_body = {
         "model": "claude-3-sonnet-20240229",
-        "max_tokens": 2000,
+        "system": _SYSTEM_PROMPT,
+        "max_tokens": FALLBACK_MAX_OUTPUT_TOKENS,
         "messages": [
             {
                 "role": "user",
@@ -1001,20 +1862,15 @@ async def call_claude_api(
         ]
     }
 
-    async def make_request():
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.anthropic.com/v1/messages',
-                headers={
-                    'Content-Type': 'application/json',
-                    'x-api-key': CLAUDE_API_KEY,
-                    'anthropic-version': '2023-06-01'
-                },
-                json=request_body
-            ) as response:
-                return await response.json()
-
-    result = await with_timeout(make_request(), timeout_seconds, 'CLAUDE')
+    result = await _post_json(
+        'https://api.anthropic.com/v1/messages',
+        {
+            'Content-Type': 'application/json',
+            'x-api-key': CLAUDE_API_KEY,
+            'anthropic-version': '2023-06-01'
+        },
+        request_body, timeout_seconds, 'CLAUDE'
+    )
 
     # Extract text from Claude response
     text = ''
@@ -1037,15 +1893,13 @@ async def call_gemini_api(
     image_data: Optional[Tuple[str, str]] = None
 ) -> tuple[str, dict]:
     """Call Google Gemini API with optional vision support"""
-    import aiohttp
-
     if not GEMINI_API_KEY:
         raise Exception("GEMINI_API_KEY not configured")
 
     # Build parts based on whether we have an image
     parts = [
         {
-            "text": f"{get_default_system_prompt()}\n\nUser message:\n{message}"
+            "text": message
         }
     ]
 
@@ -1060,25 +1914,23 @@ async def call_gemini_api(
         })
 
     request_body = {
+        "systemInstruction": {
+            "parts": [{"text": _SYSTEM_PROMPT}]
+        },
         "contents": [{
             "parts": parts
         }],
         "generationConfig": {
             "temperature": 0.7,
-            "maxOutputTokens": 2000,
+            "maxOutputTokens": FALLBACK_MAX_OUTPUT_TOKENS,
         }
     }
 
-    async def make_request():
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}',
-                headers={'Content-Type': 'application/json'},
-                json=request_body
-            ) as response:
-                return await response.json()
-
-    result = await with_timeout(make_request(), timeout_seconds, 'GEMINI')
+    result = await _post_json(
+        f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}',
+        {'Content-Type': 'application/json'},
+        request_body, timeout_seconds, 'GEMINI'
+    )
 
     # Extract text from Gemini response
     text = ''
@@ -1096,19 +1948,80 @@ async def call_gemini_api(
     return text, metadata
 
 
+# Seconds to wait on a provider before starting the next fallback in parallel
+FALLBACK_STAGGER_SECONDS = 15
+
+# Cache successful text-only answers: many students ask the same canonical
+# past-paper questions, and a hit skips a 30-180s provider round trip
+RESPONSE_CACHE_TTL = 86400  # 24 hours
+RESPONSE_CACHE_MAX_ENTRIES = 10_000
+_response_cache: Dict[str, Tuple[float, str, dict]] = {}
+
+# Text questions currently being answered, keyed like the response cache, so
+# a near-simultaneous duplicate awaits the in-flight call instead of firing
+# a second provider request
+_inflight_responses: Dict[str, "asyncio.Future"] = {}
+
+
+def _response_cache_key(message: str) -> str:
+    """Stable compact key for a question text"""
+    return hashlib.blake2b(message.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _response_cache_get(message: str) -> Optional[Tuple[str, dict]]:
+    """Return a cached (response, metadata) pair if still fresh"""
+    entry = _response_cache.get(_response_cache_key(message))
+    if entry is None:
+        return None
+    cached_at, response, metadata = entry
+    if time.time() - cached_at > RESPONSE_CACHE_TTL:
+        _response_cache.pop(_response_cache_key(message), None)
+        return None
+    return response, metadata
+
+
+def _response_cache_put(message: str, response: str, metadata: dict):
+    """Store a successful answer, evicting the oldest entry when full"""
+    if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+        oldest_key = min(_response_cache, key=lambda k: _response_cache[k][0])
+        del _response_cache[oldest_key]
+    _response_cache[_response_cache_key(message)] = (time.time(), response, metadata)
+
+
 async def get_ai_response(
     message: str,
     message_length: int,
     image_data: Optional[Tuple[str, str]] = None
 ) -> tuple[str, dict]:
     """
-    Get AI response with fallback chain: GPT-5 → Claude → Gemini
+    Get AI response with staggered fallback chain: GPT-5 → Claude → Gemini
+
+    GPT-5 is fired immediately; if it hasn't answered within
+    FALLBACK_STAGGER_SECONDS the next provider starts in parallel and the
+    first non-empty response wins (losers are cancelled). This keeps tail
+    latency near the fastest provider instead of the sum of all timeouts.
+
     Returns: (response_text, metadata)
     image_data: Optional tuple of (base64_image, mime_type)
     """
     # Select model based on message complexity and image presence
     has_image = image_data is not None
 
+    # Identical text questions are served from the in-memory cache (image
+    # questions are never cached - hashing pixels isn't worth it here)
+    if not has_image:
+        cached = _response_cache_get(message)
+        if cached is not None:
+            logger.info("[AI] Cache hit: %s chars", len(cached[0]))
+            return cached
+
+        # If the same question is already racing a provider, share that call
+        # instead of paying for a second one
+        inflight = _inflight_responses.get(_response_cache_key(message))
+        if inflight is not None:
+            logger.info("[AI] Coalescing duplicate in-flight question")
+            return await asyncio.shield(inflight)
+
     if has_image:
         # For images, always use the most capable model with longer timeout
         selected_model = 'gpt-5'
@@ -1128,46 +2041,76 @@ async def get_ai_response(
         max_output = 1000
         timeout = 90  # 1.5 minutes
 
-    logger.info(f"[AI] Selected model: {selected_model}, has_image: {has_image}")
+    logger.info("[AI] Selected model: %s, has_image: %s", selected_model, has_image)
 
-    # Try OpenAI GPT-5 first
+    # Providers in preference order; each is started at most once
+    fallback_timeout = 180 if has_image else 120
+    providers = []
     if OPENAI_API_KEY:
-        try:
-            logger.info("[AI] Attempting OpenAI GPT-5...")
-            response, metadata = await call_openai_responses_api(
-                message, selected_model, max_output, timeout, image_data
-            )
-            if response and response.strip():
-                logger.info(f"[AI] ✅ OpenAI success: {len(response)} chars")
-                return response, metadata
-        except Exception as e:
-            logger.error(f"[AI] OpenAI failed: {e}")
-
-    # Fallback to Claude
+        providers.append(('OpenAI', lambda: call_openai_responses_api(
+            message, selected_model, max_output, timeout, image_data
+        )))
     if CLAUDE_API_KEY:
-        try:
-            logger.info("[AI] Attempting Claude fallback...")
-            fallback_timeout = 180 if has_image else 120
-            response, metadata = await call_claude_api(message, fallback_timeout, image_data)
-            if response and response.strip():
-                logger.info(f"[AI] ✅ Claude success: {len(response)} chars")
-                return response, metadata
-        except Exception as e:
-            logger.error(f"[AI] Claude failed: {e}")
-
-    # Fallback to Gemini
+        providers.append(('Claude', lambda: call_claude_api(message, fallback_timeout, image_data)))
     if GEMINI_API_KEY:
+        providers.append(('Gemini', lambda: call_gemini_api(message, fallback_timeout, image_data)))
+
+    async def _race() -> tuple[str, dict]:
+        next_provider = 0
+        tasks: Dict[asyncio.Task, str] = {}
+
         try:
-            logger.info("[AI] Attempting Gemini fallback...")
-            fallback_timeout = 180 if has_image else 120
-            response, metadata = await call_gemini_api(message, fallback_timeout, image_data)
-            if response and response.strip():
-                logger.info(f"[AI] ✅ Gemini success: {len(response)} chars")
-                return response, metadata
-        except Exception as e:
-            logger.error(f"[AI] Gemini failed: {e}")
+            while True:
+                # Launch the next provider (first iteration, stagger elapsed,
+                # or all running attempts have failed)
+                if next_provider < len(providers):
+                    name, factory = providers[next_provider]
+                    next_provider += 1
+                    logger.info("[AI] Attempting %s...", name)
+                    tasks[asyncio.create_task(factory())] = name
+
+                if not tasks:
+                    break
+
+                # While unstarted fallbacks remain, wait at most the stagger
+                # interval before adding the next one to the race
+                wait_timeout = FALLBACK_STAGGER_SECONDS if next_provider < len(providers) else None
+                done, _ = await asyncio.wait(
+                    tasks.keys(), timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED
+                )
 
-    raise Exception("All AI services failed to respond")
+                for task in done:
+                    name = tasks.pop(task)
+                    try:
+                        response, metadata = task.result()
+                    except Exception as e:
+                        logger.error(f"[AI] {name} failed: {e}")
+                        continue
+                    if response and response.strip():
+                        logger.info("[AI] ✅ %s success: %s chars", name, len(response))
+                        if not has_image:
+                            _response_cache_put(message, response, metadata)
+                        return response, metadata
+                    logger.error(f"[AI] {name} returned empty response")
+        finally:
+            # Cancel whichever providers are still racing
+            for task in tasks:
+                task.cancel()
+
+        raise Exception("All AI services failed to respond")
+
+    if has_image:
+        return await _race()
+
+    # Register the race so concurrent duplicates of the same question
+    # coalesce onto it rather than starting their own
+    key = _response_cache_key(message)
+    race_task = asyncio.ensure_future(_race())
+    _inflight_responses[key] = race_task
+    try:
+        return await race_task
+    finally:
+        _inflight_responses.pop(key, None)
 
 
 # ============================================================================
@@ -1175,13 +2118,14 @@ async def get_ai_response(
 # ============================================================================
 
 def is_owner(user_id: int) -> bool:
-    """Check if user is the bot owner"""
-    if not OWNER_USER_ID:
-        return False
-    try:
-        return str(user_id) == str(OWNER_USER_ID)
-    except:
-        return False
+    """Check if user is a bot owner"""
+    return user_id in OWNER_IDS
+
+
+# Cached bot identity for mention checks; context.bot.username is a property
+# lookup and the @mention string never changes after startup
+_bot_mention: Optional[str] = None
+_bot_id: Optional[int] = None
 
 
 def is_bot_mentioned(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -1192,51 +2136,27 @@ def is_bot_mentioned(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool
     - Bot is mentioned via @username
     - Message is a reply to bot's message
     """
-    chat_type = update.effective_chat.type
-
     # Always respond in private chats
-    if chat_type == 'private':
+    if update.effective_chat.type == 'private':
         return True
 
+    global _bot_mention, _bot_id
+    if _bot_mention is None:
+        _bot_id = context.bot.id
+        _bot_mention = f"@{context.bot.username}"
+
     # In groups/supergroups, check if bot is mentioned
     message = update.message
 
     # Check if message is a reply to the bot
-    if message.reply_to_message and message.reply_to_message.from_user.is_bot:
-        bot_id = context.bot.id
-        if message.reply_to_message.from_user.id == bot_id:
-            return True
-
-    # Check if bot is mentioned via @username in text
-    if message.text:
-        # Check for @username mention
-        bot_username = context.bot.username
-        if bot_username and f"@{bot_username}" in message.text:
-            return True
-
-        # Check for mentions in entities
-        if message.entities:
-            for entity in message.entities:
-                if entity.type == "mention":
-                    mention_text = message.text[entity.offset:entity.offset + entity.length]
-                    if mention_text == f"@{bot_username}":
-                        return True
-
-    # Check for photo with caption mentioning bot
-    if message.caption:
-        bot_username = context.bot.username
-        if bot_username and f"@{bot_username}" in message.caption:
-            return True
+    reply = message.reply_to_message
+    if reply and reply.from_user.is_bot and reply.from_user.id == _bot_id:
+        return True
 
-        # Check caption entities
-        if message.caption_entities:
-            for entity in message.caption_entities:
-                if entity.type == "mention":
-                    mention_text = message.caption[entity.offset:entity.offset + entity.length]
-                    if mention_text == f"@{bot_username}":
-                        return True
-
-    return False
+    # A substring check on text/caption also covers every entity-based
+    # mention, since an entity's mention text is a slice of the same string
+    text = message.text or message.caption
+    return bool(text) and _bot_mention in text
 
 
 async def owner_only(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -1252,10 +2172,38 @@ async def owner_only(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool
         "This command is only available to the bot owner.\n\n"
         "If you are the bot owner, please configure your OWNER_USER_ID in the .env file."
     )
-    logger.warning(f"[ADMIN] Unauthorized access attempt by user {user_id} ({update.effective_user.username})")
+    logger.warning("[ADMIN] Unauthorized access attempt by user %s (%s)", user_id, update.effective_user.username)
     return False
 
 
+_ADMIN_PRIVATE_ONLY_MSG = (
+    "⚠️ <b>Admin Commands in Private Only</b>\n\n"
+    "Owner commands only work in private chat with the bot.\n"
+    "Please use these commands in a direct message, not in groups."
+)
+
+
+def owner_private_only(fn=None, *, rejected=None):
+    """Decorator: require owner access and a private chat before running the handler.
+
+    `rejected` is what the wrapper returns when the checks fail — pass
+    ConversationHandler.END for conversation entry points.
+    """
+    def decorate(handler):
+        @wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if not await owner_only(update, context):
+                return rejected
+            if update.effective_chat.type != 'private':
+                await update.message.reply_text(_ADMIN_PRIVATE_ONLY_MSG, parse_mode=ParseMode.HTML)
+                return rejected
+            return await handler(update, context)
+        return wrapper
+    if fn is not None:
+        return decorate(fn)
+    return decorate
+
+
 # ============================================================================
 # Advertisement Functions
 # ============================================================================
@@ -1302,116 +2250,183 @@ async def send_advertisement(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.error(f"[AD] Failed to send advertisement: {e}")
 
 
-async def post_scheduled_ad(context: ContextTypes.DEFAULT_TYPE, ad_id: str, ad_data: dict):
+async def post_scheduled_ad(bot, ad_id: str, ad_data: dict):
     """Post a scheduled advertisement to target groups"""
     try:
         ad_type = ad_data.get('type')
         target_groups = ad_data.get('target_groups', [])
         content = ad_data.get('content', {})
 
-        # Delete old messages first
+        # Delete old messages first (concurrently; failures are non-fatal)
         old_messages = ad_scheduler.get_posted_messages(ad_id)
-        for chat_id, message_id in old_messages.items():
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                logger.info(f"[SCHEDULER] Deleted old ad message {message_id} from chat {chat_id}")
-            except Exception as e:
-                logger.warning(f"[SCHEDULER] Failed to delete old message: {e}")
+        if old_messages:
+            async def _delete_one(chat_id: int, message_id: int):
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=message_id)
+                    logger.debug("[SCHEDULER] Deleted old ad message %s from chat %s", message_id, chat_id)
+                except Exception as e:
+                    logger.warning(f"[SCHEDULER] Failed to delete old message: {e}")
+
+            await asyncio.gather(*(
+                _delete_one(chat_id, message_id)
+                for chat_id, message_id in old_messages.items()
+            ))
+
+        if ad_type == 'image' and content.get('file_id'):
+            file_id = content['file_id']
+            caption = content.get('caption', '')
+
+            async def _send_one(chat_id: int):
+                message = await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file_id,
+                    caption=caption,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                ad_scheduler.mark_as_posted(ad_id, chat_id, message.message_id)
 
-        # Post new ad to all target groups
-        for chat_id in target_groups:
-            try:
-                if ad_type == 'image':
-                    file_id = content.get('file_id')
-                    caption = content.get('caption', '')
-
-                    if file_id:
-                        message = await context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=file_id,
-                            caption=caption,
-                            parse_mode=ParseMode.MARKDOWN
-                        )
-                        ad_scheduler.mark_as_posted(ad_id, chat_id, message.message_id)
-                        logger.info(f"[SCHEDULER] Posted image ad '{ad_data['name']}' to chat {chat_id}")
-
-                elif ad_type == 'text':
-                    text = content.get('text', '')
-
-                    if text:
-                        message = await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=text,
-                            parse_mode=ParseMode.MARKDOWN
-                        )
-                        ad_scheduler.mark_as_posted(ad_id, chat_id, message.message_id)
-                        logger.info(f"[SCHEDULER] Posted text ad '{ad_data['name']}' to chat {chat_id}")
+        elif ad_type == 'text' and content.get('text'):
+            text = content['text']
 
-            except Exception as e:
-                logger.error(f"[SCHEDULER] Failed to post ad to chat {chat_id}: {e}")
+            async def _send_one(chat_id: int):
+                message = await bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                ad_scheduler.mark_as_posted(ad_id, chat_id, message.message_id)
+
+        else:
+            return
+
+        # Fan out through the same bounded-concurrency helper broadcasts use
+        success, failed = await run_broadcast(_send_one, target_groups)
+        logger.info("[SCHEDULER] Posted ad '%s' to %s chats (%s failed)", ad_data['name'], success, failed)
 
     except Exception as e:
         logger.error(f"[SCHEDULER] Error posting scheduled ad: {e}")
 
 
-async def check_and_post_scheduled_ads(context: ContextTypes.DEFAULT_TYPE):
-    """Background task to check and post scheduled advertisements"""
-    try:
-        ads_to_post = ad_scheduler.get_ads_to_post()
-
-        if ads_to_post:
-            logger.info(f"[SCHEDULER] Found {len(ads_to_post)} ads to post")
+# Safety cap on one scheduler sleep (clock skew, missed wakeups) and the
+# pause before re-attempting an ad whose posts all failed
+SCHEDULER_MAX_SLEEP = 300
+SCHEDULER_RETRY_SECONDS = 60
 
-            for ad_id, ad_data in ads_to_post:
-                await post_scheduled_ad(context, ad_id, ad_data)
 
-    except Exception as e:
-        logger.error(f"[SCHEDULER] Error in background task: {e}")
+async def _ad_scheduler_loop(application):
+    """Sleep until the next ad is due and post everything that fires.
 
+    Event-driven replacement for the old fixed 5-minute polling job: the
+    loop sleeps exactly until the earliest scheduled ad (waking early when
+    an admin edits the schedule via wait_for_change), so posting latency
+    is near zero and an idle schedule costs no wakeups at all.
+    """
+    while True:
+        try:
+            ad_scheduler.clear_change()
+            next_fire = ad_scheduler.next_fire_time()
+            if next_fire is None:
+                delay = SCHEDULER_MAX_SLEEP
+            else:
+                delay = min(max(next_fire - time.time(), 0), SCHEDULER_MAX_SLEEP)
+
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(ad_scheduler.wait_for_change(), timeout=delay)
+                    continue  # schedule changed - recompute the sleep
+                except asyncio.TimeoutError:
+                    pass
+
+            ads_to_post = ad_scheduler.get_ads_to_post()
+            if ads_to_post:
+                logger.info("[SCHEDULER] Found %s ads to post", len(ads_to_post))
+                await asyncio.gather(*(
+                    post_scheduled_ad(application.bot, ad_id, ad_data)
+                    for ad_id, ad_data in ads_to_post
+                ))
+                # An ad whose sends all failed is still due (mark_as_posted
+                # never ran); pace the retry instead of spinning
+                next_fire = ad_scheduler.next_fire_time()
+                if next_fire is not None and next_fire <= time.time():
+                    await asyncio.sleep(SCHEDULER_RETRY_SECONDS)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[SCHEDULER] Error in scheduler loop: {e}")
+            await asyncio.sleep(SCHEDULER_RETRY_SECONDS)
 
-async def start_scheduler_task(application):
-    """Start the background scheduler task"""
-    job_queue = application.job_queue
 
-    if job_queue is None:
-        logger.error("[SCHEDULER] JobQueue not available! Install with: pip install python-telegram-bot[job-queue]")
-        return
+async def shutdown_cleanup(application):
+    """Flush pending writes and close the shared HTTP session"""
+    await usage_tracker.flush()
+    await ad_manager.flush()
+    await ad_scheduler.flush()
+    await close_http_session()
 
-    # Run every 5 minutes
-    job_queue.run_repeating(
-        check_and_post_scheduled_ads,
-        interval=300,  # 5 minutes in seconds
-        first=10  # Start after 10 seconds
-    )
 
-    logger.info("[SCHEDULER] Background task started (runs every 5 minutes)")
+async def start_scheduler_task(application):
+    """Start the background scheduler loop"""
+    application.create_task(_ad_scheduler_loop(application))
+    logger.info("[SCHEDULER] Event-driven scheduler loop started")
 
 
 # ============================================================================
 # Command Handlers
 # ============================================================================
 
+# Reply-keyboard button labels. One shared constant per button keeps the
+# keyboard builder and the button router in handle_keyboard_buttons from
+# drifting apart, and the comparisons hit the identity fast path.
+BTN_CREDITS = "💳 Credits"
+BTN_STATUS = "📊 Status"
+BTN_BUY = "🛒 Buy Credits"
+BTN_HELP = "❓ Help"
+BTN_LINKS = "🔗 Links"
+BTN_SETTINGS = "⚙️ Settings"
+BTN_BROADCAST = "📢 Broadcast"
+BTN_SET_AD = "📺 Set Ad"
+BTN_TOGGLE_AD = "🔄 Toggle Ad"
+BTN_CREATE_AD = "📅 Create Ad"
+BTN_LIST_ADS = "📋 List Ads"
+BTN_AI_ENABLE = "🔊 Enable AI"
+BTN_AI_DISABLE = "🔇 Disable AI"
+
+# Only three distinct keyboards exist (regular, owner with AI on, owner with
+# AI off); cache them by (is_owner, ai_enabled) instead of re-allocating a
+# dozen KeyboardButton objects per reply
+_keyboard_cache: Dict[Tuple[bool, bool], ReplyKeyboardMarkup] = {}
+
+
 def get_main_keyboard(user_id: int = None) -> ReplyKeyboardMarkup:
     """Generate main reply keyboard with quick-access buttons (only for private chats)"""
-    global OWNER_AI_ENABLED
+    key = (bool(user_id) and is_owner(user_id), OWNER_AI_ENABLED)
+    keyboard_markup = _keyboard_cache.get(key)
+    if keyboard_markup is None:
+        keyboard_markup = _keyboard_cache.setdefault(key, _build_main_keyboard(*key))
+    return keyboard_markup
+
+
+def _build_main_keyboard(for_owner: bool, ai_enabled: bool) -> ReplyKeyboardMarkup:
+    """Build one keyboard variant (cached by get_main_keyboard)"""
     # Owner gets additional admin buttons
-    if user_id and is_owner(user_id):
+    if for_owner:
         # Show appropriate AI toggle button based on current state
-        ai_button = "🔊 Enable AI" if not OWNER_AI_ENABLED else "🔇 Disable AI"
+        ai_button = BTN_AI_ENABLE if not ai_enabled else BTN_AI_DISABLE
         keyboard = [
-            [KeyboardButton("💳 Credits"), KeyboardButton("📊 Status")],
-            [KeyboardButton("🛒 Buy Credits"), KeyboardButton("❓ Help")],
-            [KeyboardButton("⚙️ Settings"), KeyboardButton("📢 Broadcast")],
-            [KeyboardButton("📺 Set Ad"), KeyboardButton("🔄 Toggle Ad")],
-            [KeyboardButton("📅 Create Ad"), KeyboardButton("📋 List Ads")],
-            [KeyboardButton(ai_button), KeyboardButton("🔗 Links")]
+            [KeyboardButton(BTN_CREDITS), KeyboardButton(BTN_STATUS)],
+            [KeyboardButton(BTN_BUY), KeyboardButton(BTN_HELP)],
+            [KeyboardButton(BTN_SETTINGS), KeyboardButton(BTN_BROADCAST)],
+            [KeyboardButton(BTN_SET_AD), KeyboardButton(BTN_TOGGLE_AD)],
+            [KeyboardButton(BTN_CREATE_AD), KeyboardButton(BTN_LIST_ADS)],
+            [KeyboardButton(ai_button), KeyboardButton(BTN_LINKS)]
         ]
     else:
         # Regular users get standard keyboard
         keyboard = [
-            [KeyboardButton("💳 Credits"), KeyboardButton("📊 Status")],
-            [KeyboardButton("🛒 Buy Credits"), KeyboardButton("❓ Help")],
-            [KeyboardButton("🔗 Links")]
+            [KeyboardButton(BTN_CREDITS), KeyboardButton(BTN_STATUS)],
+            [KeyboardButton(BTN_BUY), KeyboardButton(BTN_HELP)],
+            [KeyboardButton(BTN_LINKS)]
         ]
     return ReplyKeyboardMarkup(
         keyboard,
@@ -1428,30 +2443,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Log user ID for owner configuration
     user_id = update.effective_user.id
-    logger.info(f"[BOT] /start from user {user_id} ({update.effective_user.username}) in chat {chat.id} ({chat.type})")
-
-    welcome_message = (
-        "🤖 Welcome to NovaAiBot!\n\n"
-        "I'm here to answer your questions using advanced AI technology.\n\n"
-        "📝 How to use:\n"
-        "• Send me text questions directly\n"
-        "• Send photos of problems, diagrams, or equations\n"
-        "• Add a caption to photos for specific questions\n"
-        "• You start with 10 FREE credits\n\n"
-        "🎯 Perfect for:\n"
-        "• Physics problems with diagrams\n"
-        "• Chemistry equations and structures\n"
-        "• Biology diagrams and illustrations\n"
-        "• Math equations from textbooks\n\n"
-        "💡 Want unlimited access?\n"
-        f"Download Nova Learn App: {NOVA_LEARN_APP_LINK}\n\n"
-        f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}\n\n"
-        "Send me a question or photo to get started!"
-    )
+    logger.info("[BOT] /start from user %s (%s) in chat %s (%s)", user_id, update.effective_user.username, chat.id, chat.type)
 
     # Send welcome message with keyboard (only in private chats)
     reply_markup = get_main_keyboard(update.effective_user.id) if chat.type == 'private' else None
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    await update.message.reply_text(WELCOME_MESSAGE, reply_markup=reply_markup)
 
 
 async def keyboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1471,57 +2467,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     user_id = update.effective_user.id
 
-    help_message = (
-        "🆘 NovaAiBot Help\n\n"
-        "**Commands:**\n"
-        "/start - Start the bot\n"
-        "/help - Show this help message\n"
-        "/status - Check your credit balance\n"
-        "/credits - View available credit packages\n"
-        "/buy - Purchase credits with Telegram Stars ⭐\n"
-        "/keyboard - Show quick-access buttons\n\n"
-        "**How to Ask Questions:**\n\n"
-        "📝 Text Questions:\n"
-        "Just type and send your question\n\n"
-        "📸 Image Questions:\n"
-        "1. Take a photo of your problem/diagram\n"
-        "2. Add a caption (optional but recommended)\n"
-        "3. Send it to the bot\n\n"
-        "**Examples:**\n"
-        "• Photo of physics problem + caption: \"Solve this\"\n"
-        "• Photo of chemical structure + caption: \"What compound is this?\"\n"
-        "• Photo of biology diagram + caption: \"Explain this process\"\n"
-        "• Photo without caption: Bot will analyze and explain\n\n"
-        "**Credit System:**\n"
-        f"• Text question: {usage_tracker.TEXT_QUESTION_COST} credit\n"
-        f"• Image question: {usage_tracker.IMAGE_QUESTION_COST} credits\n"
-        f"• New users start with {usage_tracker.INITIAL_CREDITS} free credits\n"
-        f"• Daily limit: {usage_tracker.DAILY_CREDIT_LIMIT} credits per day\n"
-        "• Images must be under 5MB and clear\n"
-        "• Buy more credits with /buy using Telegram Stars ⭐\n\n"
-        f"📱 For unlimited access, download: {NOVA_LEARN_APP_LINK}\n"
-        f"📢 Join our WhatsApp: {WHATSAPP_CHANNEL_LINK}"
-    )
-
-    # Add owner-specific commands if owner is viewing
-    if is_owner(user_id):
-        help_message += (
-            "\n\n"
-            "👑 **Owner Commands** (Private Chat Only):\n"
-            "/settings - Bot settings & statistics\n"
-            "/broadcast - Send messages to users/groups\n"
-            "/addcredits - Add credits to users\n"
-            "/setcredits - Set user credits\n"
-            "/setad - Configure basic advertisement\n"
-            "/togglead - Enable/disable basic ads\n\n"
-            "📅 **Scheduled Ads:**\n"
-            "/createad - Create scheduled advertisement\n"
-            "/listads - View all scheduled ads\n"
-            "/pausead <id> - Pause an ad\n"
-            "/resumead <id> - Resume an ad\n"
-            "/deletead <id> - Delete an ad\n\n"
-            "💡 Use keyboard buttons for quick access!"
-        )
+    # Owner sees the extra admin command listing
+    help_message = HELP_MESSAGE_OWNER if is_owner(user_id) else HELP_MESSAGE
 
     # Show keyboard in private chats
     reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
@@ -1574,28 +2521,27 @@ async def credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     current_credits = usage_tracker.get_credits(user_id)
 
     credits_message = (
-        "💳 **NovaAI Credit Packages**\n\n"
-        f"💰 Your Balance: **{current_credits} credits**\n\n"
-        "📦 **Available Packages:**\n\n"
+        "💳 <b>NovaAI Credit Packages</b>\n\n"
+        f"💰 Your Balance: <b>{current_credits} credits</b>\n\n"
+        "📦 <b>Available Packages:</b>\n\n"
     )
 
-    for package_id, package_info in usage_tracker.CREDIT_PACKAGES.items():
-        credits_message += f"⭐ **{package_info['name']}**: {package_info['credits']} credits - {package_info['stars']} Stars\n"
+    credits_message += CREDIT_PACKAGE_LINES
 
     credits_message += (
-        "\n\n💡 **Credit Costs:**\n"
+        "\n\n💡 <b>Credit Costs:</b>\n"
         f"• Text question: {usage_tracker.TEXT_QUESTION_COST} credit\n"
         f"• Image question: {usage_tracker.IMAGE_QUESTION_COST} credits\n\n"
-        "🌟 **Purchase with Telegram Stars:**\n"
+        "🌟 <b>Purchase with Telegram Stars:</b>\n"
         "Use /buy to purchase credits with Telegram Stars\n\n"
-        "📱 **Or get unlimited access:**\n"
+        "📱 <b>Or get unlimited access:</b>\n"
         f"Download Nova Learn App:\n{NOVA_LEARN_APP_LINK}\n\n"
         f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
     )
 
     # Show keyboard in private chats
     reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
-    await update.message.reply_text(credits_message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    await update.message.reply_text(credits_message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
 
 
 async def buy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1616,35 +2562,37 @@ async def buy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # To enable automatic Telegram Stars: Go to @BotFather → /mybots → Your Bot → Bot Settings → Payments → Telegram Stars
 
     buy_message = (
-        "🛒 **Purchase NovaAI Credits**\n\n"
-        f"💰 Your Current Balance: **{current_credits} credits**\n\n"
-        "📦 **Available Packages:**\n\n"
+        "🛒 <b>Purchase NovaAI Credits</b>\n\n"
+        f"💰 Your Current Balance: <b>{current_credits} credits</b>\n\n"
+        "📦 <b>Available Packages:</b>\n\n"
     )
 
-    for package_id, package_info in usage_tracker.CREDIT_PACKAGES.items():
-        buy_message += (
-            f"⭐ **{package_info['name']}** - {package_info['stars']} Stars\n"
-            f"   • {package_info['credits']} credits - {package_info['description']}\n\n"
-        )
+    buy_message += CREDIT_PACKAGE_DETAILS
 
     buy_message += (
-        "\n💳 **How to Purchase:**\n\n"
-        "⚠️ **Telegram Stars automatic payment is not yet available.**\n\n"
-        "📝 **Manual Purchase Process:**\n"
-        f"1️⃣ Your User ID: `{user_id}`\n"
-        f"2️⃣ Your Username: @{username}\n"
+        "\n💳 <b>How to Purchase:</b>\n\n"
+        "⚠️ <b>Telegram Stars automatic payment is not yet available.</b>\n\n"
+        "📝 <b>Manual Purchase Process:</b>\n"
+        f"1️⃣ Your User ID: <code>{user_id}</code>\n"
+        f"2️⃣ Your Username: @{html.escape(username)}\n"
         f"3️⃣ Contact the bot owner with:\n"
         f"   • Your User ID: {user_id}\n"
         "   • The package you want\n"
         "   • Payment method details\n\n"
-        "4️⃣ After payment confirmation, credits will be added to your account using `/addcredits`\n\n"
-        f"📱 **Alternative:** Download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
-        "💡 **Note:** Automatic Telegram Stars payments will be enabled soon!"
+        "4️⃣ After payment confirmation, credits will be added to your account using <code>/addcredits</code>\n\n"
+        f"📱 <b>Alternative:</b> Download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
+        "💡 <b>Note:</b> Automatic Telegram Stars payments will be enabled soon!"
     )
 
     # Show keyboard in private chats
     reply_markup = get_main_keyboard(update.effective_user.id)
-    await update.message.reply_text(buy_message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+    await update.message.reply_text(buy_message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+
+
+# Invoice payload format: credits_<package_id>_<user_id>. One compiled match
+# extracts both fields instead of startswith + split on the hot callback path.
+_BUY_PREFIX = "buy_"
+_PAYLOAD_RE = re.compile(r"^credits_([A-Za-z0-9]+)_(\d+)$")
 
 
 async def handle_buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1657,28 +2605,20 @@ async def handle_buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id = update.effective_user.id
         current_credits = usage_tracker.get_credits(user_id)
 
-        # Create inline keyboard with package options
-        keyboard = []
-        for package_id, package_info in usage_tracker.CREDIT_PACKAGES.items():
-            button_text = f"⭐ {package_info['name']} - {package_info['stars']} Stars"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"buy_{package_id}")])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         buy_message = (
-            "🛒 **Purchase NovaAI Credits**\n\n"
-            f"💰 Your Current Balance: **{current_credits} credits**\n\n"
-            "📦 **Select a package to purchase:**\n\n"
+            "🛒 <b>Purchase NovaAI Credits</b>\n\n"
+            f"💰 Your Current Balance: <b>{current_credits} credits</b>\n\n"
+            "📦 <b>Select a package to purchase:</b>\n\n"
             "Payment is securely processed through Telegram Stars.\n"
             "Credits will be added to your account immediately after payment."
         )
 
-        await query.edit_message_text(buy_message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        await query.edit_message_text(buy_message, reply_markup=BUY_PACKAGE_KEYBOARD, parse_mode=ParseMode.HTML)
         return
 
     # Handle buy_<package_id> callbacks
-    if query.data.startswith("buy_"):
-        package_id = query.data.replace("buy_", "")
+    if query.data.startswith(_BUY_PREFIX):
+        package_id = query.data.removeprefix(_BUY_PREFIX)
 
         if package_id not in usage_tracker.CREDIT_PACKAGES:
             await query.edit_message_text("❌ Invalid package selected.")
@@ -1694,20 +2634,20 @@ async def handle_buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
                 description=package['description'],
                 payload=f"credits_{package_id}_{query.from_user.id}",  # Custom payload to identify the purchase
                 currency="XTR",  # Telegram Stars currency code
-                prices=[LabeledPrice(label=package['name'], amount=package['stars'])],
+                prices=PACKAGE_INVOICE_PRICES[package_id],
             )
 
             await query.edit_message_text(
-                f"✅ **Invoice Sent!**\n\n"
+                f"✅ <b>Invoice Sent!</b>\n\n"
                 f"📦 Package: {package['name']}\n"
                 f"💎 Credits: {package['credits']}\n"
                 f"⭐ Price: {package['stars']} Telegram Stars\n\n"
                 "Please complete the payment to receive your credits.",
-                parse_mode=ParseMode.MARKDOWN
+                parse_mode=ParseMode.HTML
             )
 
         except Exception as e:
-            logger.error(f"[PAYMENT] Error sending invoice: {e}")
+            logger.error("[PAYMENT] Error sending invoice: %s", e)
             await query.edit_message_text(
                 "❌ Failed to create payment invoice.\n\n"
                 "This could be because:\n"
@@ -1724,53 +2664,111 @@ async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     # Validate the payload
     payload = query.invoice_payload
 
-    if not payload.startswith("credits_"):
-        logger.error(f"[PAYMENT] Invalid payload: {payload}")
+    match = _PAYLOAD_RE.match(payload)
+    if not match:
+        logger.error("[PAYMENT] Invalid payload: %s", payload)
         await query.answer(ok=False, error_message="Invalid purchase. Please try again.")
         return
 
     # Parse payload: credits_<package_id>_<user_id>
     try:
-        parts = payload.split("_")
-        package_id = parts[1]
-        user_id = int(parts[2])
+        package_id = match.group(1)
+        user_id = int(match.group(2))
 
         # Verify package exists
         if package_id not in usage_tracker.CREDIT_PACKAGES:
-            logger.error(f"[PAYMENT] Invalid package: {package_id}")
+            logger.error("[PAYMENT] Invalid package: %s", package_id)
             await query.answer(ok=False, error_message="Invalid package. Please try again.")
             return
 
         # Verify user
         if user_id != query.from_user.id:
-            logger.error(f"[PAYMENT] User mismatch: {user_id} != {query.from_user.id}")
+            logger.error("[PAYMENT] User mismatch: %s != %s", user_id, query.from_user.id)
             await query.answer(ok=False, error_message="Invalid user. Please try again.")
             return
 
         # All checks passed
-        logger.info(f"[PAYMENT] Pre-checkout OK for user {user_id}, package {package_id}")
+        logger.info("[PAYMENT] Pre-checkout OK for user %s, package %s", user_id, package_id)
         await query.answer(ok=True)
 
     except Exception as e:
-        logger.error(f"[PAYMENT] Pre-checkout error: {e}")
+        logger.error("[PAYMENT] Pre-checkout error: %s", e)
         await query.answer(ok=False, error_message="Validation error. Please try again.")
 
 
+# Payment idempotency: Telegram can redeliver a successful_payment update
+# (network retry, restart before the update is acknowledged). Remember which
+# charge ids were already credited so a replay never double-credits a user.
+PAYMENTS_FILE = "processed_payments.json"
+PAYMENT_DEDUP_TTL = 86400 * 30  # seconds; covers Telegram's redelivery window
+
+
+def _load_processed_payments() -> Dict[str, Any]:
+    """Load previously credited payments, dropping entries older than the TTL"""
+    if os.path.exists(PAYMENTS_FILE):
+        try:
+            with open(PAYMENTS_FILE, 'rb') as f:
+                raw = f.read()
+            records = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            cutoff = time.time() - PAYMENT_DEDUP_TTL
+            return {cid: rec for cid, rec in records.items() if rec.get('ts', 0) >= cutoff}
+        except Exception as e:
+            logger.error("[PAYMENT] Error loading processed payments: %s", e)
+    return {}
+
+
+_processed_payments: Dict[str, Any] = _load_processed_payments()
+
+
+def _record_processed_payment(charge_id: str, record: Dict[str, Any]):
+    """Persist a credited payment atomically via tmp + rename (blocking)"""
+    _processed_payments[charge_id] = record
+    tmp = PAYMENTS_FILE + '.tmp'
+    try:
+        if orjson is not None:
+            with open(tmp, 'wb') as f:
+                f.write(orjson.dumps(_processed_payments))
+        else:
+            with open(tmp, 'w') as f:
+                json.dump(_processed_payments, f, separators=(',', ':'))
+        os.replace(tmp, PAYMENTS_FILE)
+    except Exception as e:
+        logger.error("[PAYMENT] Error saving processed payments: %s", e)
+
+
+async def _notify_owner_safe(bot, text: str):
+    """Send a notification to the primary owner, logging instead of raising"""
+    try:
+        await bot.send_message(
+            chat_id=_PRIMARY_OWNER_ID,
+            text=text,
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        logger.error("[PAYMENT] Failed to notify owner: %s", e)
+
+
 async def successful_payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle successful payments - add credits to user"""
     user_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
     payment = update.message.successful_payment
 
+    # Drop redelivered updates before touching balances
+    charge_id = payment.telegram_payment_charge_id
+    if charge_id in _processed_payments:
+        logger.info("[PAYMENT] Duplicate payment %s from user %s ignored", charge_id, user_id)
+        return
+
     # Parse payload
     payload = payment.invoice_payload
 
     try:
-        parts = payload.split("_")
-        package_id = parts[1]
+        match = _PAYLOAD_RE.match(payload)
+        package_id = match.group(1) if match else None
 
         if package_id not in usage_tracker.CREDIT_PACKAGES:
-            logger.error(f"[PAYMENT] Invalid package in successful payment: {package_id}")
+            logger.error("[PAYMENT] Invalid package in successful payment: %s", package_id)
             await update.message.reply_text("❌ Error processing your payment. Please contact support.")
             return
 
@@ -1780,102 +2778,103 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
         # Add credits to user
         new_balance = usage_tracker.add_credits(user_id, credits_to_add, username)
 
+        # Mark the charge as credited (with context for auditing) so a
+        # redelivery of this update cannot credit the user again
+        await asyncio.to_thread(_record_processed_payment, charge_id, {
+            'ts': time.time(),
+            'user_id': user_id,
+            'package_id': package_id,
+            'credits': credits_to_add,
+            'balance': new_balance,
+        })
+
         logger.info(
-            f"[PAYMENT] ✅ Payment successful! User {user_id} purchased {package_id} "
-            f"for {package['stars']} stars. Added {credits_to_add} credits. New balance: {new_balance}"
+            "[PAYMENT] ✅ Payment successful! User %s purchased %s for %s stars. "
+            "Added %s credits. New balance: %s",
+            user_id, package_id, package['stars'], credits_to_add, new_balance
         )
 
         # Send success message
         success_message = (
-            "✅ **Payment Successful!**\n\n"
+            "✅ <b>Payment Successful!</b>\n\n"
             f"🎁 Package: {package['name']}\n"
-            f"💎 Credits Added: **{credits_to_add}**\n"
-            f"💰 New Balance: **{new_balance} credits**\n\n"
+            f"💎 Credits Added: <b>{credits_to_add}</b>\n"
+            f"💰 New Balance: <b>{new_balance} credits</b>\n\n"
             "Thank you for your purchase! 🎉\n\n"
             "You can now use your credits to ask questions.\n"
             "Just send me your question to get started!"
         )
 
-        await update.message.reply_text(success_message, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text(success_message, parse_mode=ParseMode.HTML)
 
-        # Notify owner about the purchase (if owner is set)
-        if OWNER_USER_ID:
-            try:
-                owner_notification = (
-                    f"💰 **New Purchase!**\n\n"
-                    f"👤 User: {username} (ID: {user_id})\n"
-                    f"📦 Package: {package['name']}\n"
-                    f"⭐ Stars: {package['stars']}\n"
-                    f"💎 Credits: {credits_to_add}\n"
-                    f"💰 User Balance: {new_balance}"
-                )
-                await context.bot.send_message(
-                    chat_id=int(OWNER_USER_ID),
-                    text=owner_notification,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except Exception as e:
-                logger.error(f"[PAYMENT] Failed to notify owner: {e}")
+        # Notify owner about the purchase (if owner is set). Fire-and-forget:
+        # the user's confirmation is already sent, so there is no reason to
+        # hold this handler open for another round trip to Telegram.
+        if _PRIMARY_OWNER_ID is not None:
+            owner_notification = (
+                f"💰 <b>New Purchase!</b>\n\n"
+                f"👤 User: {html.escape(username)} (ID: {user_id})\n"
+                f"📦 Package: {package['name']}\n"
+                f"⭐ Stars: {package['stars']}\n"
+                f"💎 Credits: {credits_to_add}\n"
+                f"💰 User Balance: {new_balance}"
+            )
+            context.application.create_task(
+                _notify_owner_safe(context.bot, owner_notification)
+            )
 
     except Exception as e:
-        logger.error(f"[PAYMENT] Error processing successful payment: {e}")
+        logger.error("[PAYMENT] Error processing successful payment: %s", e)
         await update.message.reply_text(
             "⚠️ Payment received but there was an error adding credits.\n"
             "Please contact support with your payment details."
         )
 
 
+# Button text -> command handler routing table for handle_keyboard_buttons.
+# Populated lazily on first press because the owner command handlers are
+# defined further down in the file.
+_BUTTON_ROUTES: Dict[str, Callable] = {}
+
+_AI_TOGGLE_BUTTONS = frozenset((BTN_AI_DISABLE, BTN_AI_ENABLE))
+
+
 async def handle_keyboard_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle keyboard button presses"""
     text = update.message.text
 
+    if not _BUTTON_ROUTES:
+        _BUTTON_ROUTES.update({
+            BTN_CREDITS: credits_command,
+            BTN_STATUS: status_command,
+            BTN_BUY: buy_command,
+            BTN_HELP: help_command,
+            # Owner-only buttons
+            BTN_SETTINGS: settings_command,
+            BTN_BROADCAST: broadcast_command,
+            BTN_SET_AD: setad_command,
+            BTN_TOGGLE_AD: togglead_command,
+            BTN_CREATE_AD: createad_command,
+            BTN_LIST_ADS: listads_command,
+        })
+
     # Route to appropriate command based on button text
-    if text == "💳 Credits":
-        await credits_command(update, context)
-    elif text == "📊 Status":
-        await status_command(update, context)
-    elif text == "🛒 Buy Credits":
-        await buy_command(update, context)
-    elif text == "❓ Help":
-        await help_command(update, context)
-    elif text == "🔗 Links":
+    handler = _BUTTON_ROUTES.get(text)
+    if handler is not None:
+        await handler(update, context)
+    elif text == BTN_LINKS:
         # Show useful links
-        links_message = (
-            "🔗 **NovaAI Links**\n\n"
-            "📱 **Nova Learn App** (Unlimited Access):\n"
-            f"{NOVA_LEARN_APP_LINK}\n\n"
-            "📢 **WhatsApp Channel** (Updates & Support):\n"
-            f"{WHATSAPP_CHANNEL_LINK}\n\n"
-            "💡 **Join our community** for:\n"
-            "• Latest updates and features\n"
-            "• Study tips and resources\n"
-            "• Special offers and promotions\n"
-            "• 24/7 community support"
-        )
         reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
-        await update.message.reply_text(links_message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
-    # Owner-only buttons
-    elif text == "⚙️ Settings":
-        await settings_command(update, context)
-    elif text == "📢 Broadcast":
-        await broadcast_command(update, context)
-    elif text == "📺 Set Ad":
-        await setad_command(update, context)
-    elif text == "🔄 Toggle Ad":
-        await togglead_command(update, context)
-    elif text == "📅 Create Ad":
-        await createad_command(update, context)
-    elif text == "📋 List Ads":
-        await listads_command(update, context)
-    elif text in ["🔇 Disable AI", "🔊 Enable AI"]:
+        await update.message.reply_text(LINKS_MESSAGE, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+    elif text in _AI_TOGGLE_BUTTONS:
         # Toggle AI response mode for owner
         global OWNER_AI_ENABLED
         OWNER_AI_ENABLED = not OWNER_AI_ENABLED
         status = "enabled" if OWNER_AI_ENABLED else "disabled"
         icon = "🔊" if OWNER_AI_ENABLED else "🔇"
         message = (
-            f"{icon} **AI Mode {status.upper()}**\n\n"
-            f"AI responses are now **{status}** for you.\n\n"
+            f"{icon} <b>AI Mode {status.upper()}</b>\n\n"
+            f"AI responses are now <b>{status}</b> for you.\n\n"
         )
         if OWNER_AI_ENABLED:
             message += "✅ Your messages will be processed as AI questions."
@@ -1889,27 +2888,15 @@ async def handle_keyboard_buttons(update: Update, context: ContextTypes.DEFAULT_
                 "Regular users are not affected by this setting."
             )
         reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
-        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+        await update.message.reply_text(message, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
     else:
         # Not a keyboard button, return None to allow next handler
         return None
 
 
+@owner_private_only
 async def addcredits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /addcredits command (Owner only) - Add credits to a user"""
-    if not await owner_only(update, context):
-        return
-
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
     # Parse command: /addcredits <user_id> <amount>
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
@@ -1938,30 +2925,18 @@ async def addcredits_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"New Balance: **{new_balance} credits**",
             parse_mode=ParseMode.MARKDOWN
         )
-        logger.info(f"[ADMIN] Owner added {amount} credits to user {target_user_id}")
+        logger.info("[ADMIN] Owner added %s credits to user %s", amount, target_user_id)
 
     except ValueError:
         await update.message.reply_text("❌ Invalid user ID or amount. Must be numbers.")
     except Exception as e:
-        logger.error(f"[ADMIN] Error adding credits: {e}")
+        logger.error("[ADMIN] Error adding credits: %s", e)
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 
+@owner_private_only
 async def setcredits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /setcredits command (Owner only) - Set user credits to specific amount"""
-    if not await owner_only(update, context):
-        return
-
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
     # Parse command: /setcredits <user_id> <amount>
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
@@ -1989,43 +2964,63 @@ async def setcredits_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"New Balance: **{new_balance} credits**",
             parse_mode=ParseMode.MARKDOWN
         )
-        logger.info(f"[ADMIN] Owner set user {target_user_id} credits to {amount}")
+        logger.info("[ADMIN] Owner set user %s credits to %s", target_user_id, amount)
 
     except ValueError:
         await update.message.reply_text("❌ Invalid user ID or amount. Must be numbers.")
     except Exception as e:
-        logger.error(f"[ADMIN] Error setting credits: {e}")
+        logger.error("[ADMIN] Error setting credits: %s", e)
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
 
+# Settings menu pieces are fixed, so the markup and the broadcast help texts
+# are built once instead of per /settings interaction
+_SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 View Statistics", callback_data="settings_stats")],
+    [InlineKeyboardButton("📢 Broadcast to Users", callback_data="settings_broadcast_users")],
+    [InlineKeyboardButton("📢 Broadcast to Groups", callback_data="settings_broadcast_groups")],
+    [InlineKeyboardButton("📢 Broadcast to All", callback_data="settings_broadcast_all")],
+    [InlineKeyboardButton("❌ Close", callback_data="settings_close")]
+])
+
+_SETTINGS_BROADCAST_HELP = {
+    "settings_broadcast_users": (
+        "📢 **Broadcast to Users**\n\n"
+        "**Text Broadcast:**\n"
+        "`/broadcast users <your message>`\n\n"
+        "**Image Broadcast:**\n"
+        "Send photo with caption: `#broadcast users <message>`\n\n"
+        "Example:\n"
+        "`/broadcast users Hello! Check out our new feature!`"
+    ),
+    "settings_broadcast_groups": (
+        "📢 **Broadcast to Groups**\n\n"
+        "**Text Broadcast:**\n"
+        "`/broadcast groups <your message>`\n\n"
+        "**Image Broadcast:**\n"
+        "Send photo with caption: `#broadcast groups <message>`\n\n"
+        "Example:\n"
+        "`/broadcast groups Important update for all groups!`"
+    ),
+    "settings_broadcast_all": (
+        "📢 **Broadcast to All**\n\n"
+        "**Text Broadcast:**\n"
+        "`/broadcast all <your message>`\n\n"
+        "**Image Broadcast:**\n"
+        "Send photo with caption: `#broadcast all <message>`\n\n"
+        "Examples:\n"
+        "• Text: `/broadcast all New feature available now!`\n"
+        "• Image: Send photo with caption `#broadcast all Check this out!`"
+    ),
+}
+
+
+@owner_private_only
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /settings command (Owner only)"""
-    if not await owner_only(update, context):
-        return
-
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
     # Get statistics
     stats = usage_tracker.get_statistics()
 
-    # Create inline keyboard with settings options
-    keyboard = [
-        [InlineKeyboardButton("📊 View Statistics", callback_data="settings_stats")],
-        [InlineKeyboardButton("📢 Broadcast to Users", callback_data="settings_broadcast_users")],
-        [InlineKeyboardButton("📢 Broadcast to Groups", callback_data="settings_broadcast_groups")],
-        [InlineKeyboardButton("📢 Broadcast to All", callback_data="settings_broadcast_all")],
-        [InlineKeyboardButton("❌ Close", callback_data="settings_close")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     settings_message = (
         "⚙️ **Bot Settings** (Owner Only)\n\n"
         f"👥 Total Users: {stats['total_users']}\n"
@@ -2035,7 +3030,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Choose an option below:"
     )
 
-    await update.message.reply_text(settings_message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(settings_message, reply_markup=_SETTINGS_MARKUP, parse_mode=ParseMode.MARKDOWN)
 
 
 async def settings_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2064,62 +3059,90 @@ async def settings_callback_handler(update: Update, context: ContextTypes.DEFAUL
         )
         await query.edit_message_text(stats_message, parse_mode=ParseMode.MARKDOWN)
 
-    elif data == "settings_broadcast_users":
-        await query.edit_message_text(
-            "📢 **Broadcast to Users**\n\n"
-            "**Text Broadcast:**\n"
-            "`/broadcast users <your message>`\n\n"
-            "**Image Broadcast:**\n"
-            "Send photo with caption: `#broadcast users <message>`\n\n"
-            "Example:\n"
-            "`/broadcast users Hello! Check out our new feature!`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-
-    elif data == "settings_broadcast_groups":
-        await query.edit_message_text(
-            "📢 **Broadcast to Groups**\n\n"
-            "**Text Broadcast:**\n"
-            "`/broadcast groups <your message>`\n\n"
-            "**Image Broadcast:**\n"
-            "Send photo with caption: `#broadcast groups <message>`\n\n"
-            "Example:\n"
-            "`/broadcast groups Important update for all groups!`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-
-    elif data == "settings_broadcast_all":
-        await query.edit_message_text(
-            "📢 **Broadcast to All**\n\n"
-            "**Text Broadcast:**\n"
-            "`/broadcast all <your message>`\n\n"
-            "**Image Broadcast:**\n"
-            "Send photo with caption: `#broadcast all <message>`\n\n"
-            "Examples:\n"
-            "• Text: `/broadcast all New feature available now!`\n"
-            "• Image: Send photo with caption `#broadcast all Check this out!`",
-            parse_mode=ParseMode.MARKDOWN
-        )
+    elif data in _SETTINGS_BROADCAST_HELP:
+        await query.edit_message_text(_SETTINGS_BROADCAST_HELP[data], parse_mode=ParseMode.MARKDOWN)
 
     elif data == "settings_close":
         await query.edit_message_text("⚙️ Settings closed.")
 
 
-async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /broadcast command (Owner only) - Send messages to all users/groups"""
-    if not await owner_only(update, context):
-        return
+# Precompiled matcher for legacy `#broadcast <target> <message>` photo
+# captions; shared by the message filter in main() and the handler itself
+_BROADCAST_RE = re.compile(
+    r'^#broadcast\s+(users|groups|all)(?:\s+(.*))?$',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Human-readable names for broadcast targets in status messages
+_BROADCAST_TARGET_NAMES = {
+    'users': 'users',
+    'groups': 'groups',
+    'all': 'all users and groups',
+}
+
+# Max concurrent sends during a broadcast fan-out; keeps us under Telegram's
+# ~30 msg/s global cap while overlapping the HTTPS round trips
+BROADCAST_CONCURRENCY = 25
+
+
+# Update the status message after this many completed sends
+BROADCAST_PROGRESS_EVERY = 500
+
+
+async def run_broadcast(send_one, chat_ids: List[int], status_message=None) -> Tuple[int, int]:
+    """Fan a broadcast out concurrently with a bounded semaphore.
+
+    send_one: async callable taking a chat_id and performing one send.
+    If status_message is given it is edited every few hundred sends so long
+    broadcasts show progress. Failures are collected and logged once as a
+    summary instead of one error line per unreachable chat.
+    Returns (success_count, fail_count).
+    """
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    total = len(chat_ids)
+    done = 0
+    failures: List[Tuple[int, str]] = []
+
+    async def _send(chat_id: int) -> bool:
+        nonlocal done
+        async with sem:
+            try:
+                await send_one(chat_id)
+                ok = True
+            except Forbidden as e:
+                # Bot was blocked or kicked - drop the chat so future
+                # broadcasts don't keep paying a failed round-trip for it
+                usage_tracker.remove_chat(chat_id)
+                failures.append((chat_id, str(e)))
+                ok = False
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    usage_tracker.remove_chat(chat_id)
+                failures.append((chat_id, str(e)))
+                ok = False
+            except Exception as e:
+                failures.append((chat_id, str(e)))
+                ok = False
+        done += 1
+        if (status_message is not None and done < total
+                and done % BROADCAST_PROGRESS_EVERY == 0):
+            try:
+                await status_message.edit_text(f"📢 Broadcasting... {done}/{total} sent")
+            except Exception:
+                pass  # progress is best-effort; never fail the broadcast
+        return ok
+
+    results = await asyncio.gather(*(_send(chat_id) for chat_id in chat_ids))
+    if failures:
+        logger.error("[BROADCAST] %d failures (first 20 shown): %s",
+                     len(failures), failures[:20])
+    success_count = sum(results)
+    return success_count, len(failures)
 
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
 
+@owner_private_only
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast command (Owner only) - Send messages to all users/groups"""
     # Parse command: /broadcast <target> <message>
     # target can be: users, groups, or all
     if not context.args or len(context.args) < 2:
@@ -2145,44 +3168,30 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Get chat IDs based on target
-    if target == 'users':
-        chat_ids = usage_tracker.get_all_user_chats()
-        target_name = "users"
-    elif target == 'groups':
-        chat_ids = usage_tracker.get_all_group_chats()
-        target_name = "groups"
-    else:  # all
-        chat_ids = usage_tracker.get_all_user_chats() + usage_tracker.get_all_group_chats()
-        target_name = "all users and groups"
+    # Get chat IDs based on target (deduplicated for 'all')
+    chat_ids = usage_tracker.get_broadcast_targets(target)
+    target_name = _BROADCAST_TARGET_NAMES[target]
 
     if not chat_ids:
         await update.message.reply_text(f"⚠️ No {target_name} found to broadcast to.")
         return
 
     # Confirm broadcast
-    await update.message.reply_text(
+    status_message = await update.message.reply_text(
         f"📢 **Broadcasting to {len(chat_ids)} {target_name}...**\n\n"
         f"Message: {message}\n\n"
         "Please wait..."
     )
 
-    # Send broadcast
-    success_count = 0
-    fail_count = 0
+    # Send broadcast concurrently (bounded by BROADCAST_CONCURRENCY)
+    async def _send_one(chat_id: int):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"📢 **Announcement from NovaAI**\n\n{message}",
+            parse_mode=ParseMode.MARKDOWN
+        )
 
-    for chat_id in chat_ids:
-        try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"📢 **Announcement from NovaAI**\n\n{message}",
-                parse_mode=ParseMode.MARKDOWN
-            )
-            success_count += 1
-            await asyncio.sleep(0.05)  # Small delay to avoid rate limiting
-        except Exception as e:
-            logger.error(f"[BROADCAST] Failed to send to {chat_id}: {e}")
-            fail_count += 1
+    success_count, fail_count = await run_broadcast(_send_one, chat_ids, status_message)
 
     # Report results
     result_message = (
@@ -2283,47 +3292,34 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("❌ Error: Missing broadcast data. Please start over with /broadcastimg")
         return ConversationHandler.END
 
-    # Get chat IDs based on target
-    if target == 'users':
-        chat_ids = usage_tracker.get_all_user_chats()
-        target_name = "users"
-    elif target == 'groups':
-        chat_ids = usage_tracker.get_all_group_chats()
-        target_name = "groups"
-    else:  # all
-        chat_ids = usage_tracker.get_all_user_chats() + usage_tracker.get_all_group_chats()
-        target_name = "all users and groups"
+    # Get chat IDs based on target (deduplicated for 'all')
+    chat_ids = usage_tracker.get_broadcast_targets(target)
+    target_name = _BROADCAST_TARGET_NAMES[target]
 
     if not chat_ids:
         await update.message.reply_text(f"⚠️ No {target_name} found to broadcast to.")
         return ConversationHandler.END
 
     # Confirm and start broadcast
-    await update.message.reply_text(
+    status_message = await update.message.reply_text(
         f"📢 **Broadcasting to {len(chat_ids)} {target_name}...**\n\n"
         f"Message: {message}\n\n"
         "Please wait...",
         parse_mode=ParseMode.MARKDOWN
     )
 
-    # Send broadcast
-    success_count = 0
-    fail_count = 0
+    # Send broadcast concurrently (bounded by BROADCAST_CONCURRENCY)
     full_caption = f"📢 **Announcement from NovaAI**\n\n{message}" if message else "📢 **Announcement from NovaAI**"
 
-    for chat_id in chat_ids:
-        try:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo_file_id,
-                caption=full_caption,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            success_count += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            logger.error(f"[BROADCAST_IMG] Failed to send to {chat_id}: {e}")
-            fail_count += 1
+    async def _send_one(chat_id: int):
+        await context.bot.send_photo(
+            chat_id=chat_id,
+            photo=photo_file_id,
+            caption=full_caption,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    success_count, fail_count = await run_broadcast(_send_one, chat_ids, status_message)
 
     # Report results
     result_message = (
@@ -2361,50 +3357,19 @@ async def broadcast_image_handler(update: Update, context: ContextTypes.DEFAULT_
 
     caption = update.message.caption or ""
     logger.info(f"[BROADCAST_IMG] Caption: '{caption}'")
-    logger.info(f"[BROADCAST_IMG] Caption length: {len(caption)}, First 20 chars: {repr(caption[:20])}")
 
-    # Check if caption starts with #broadcast (case-sensitive)
-    if not caption.lower().startswith("#broadcast "):
-        logger.info(f"[BROADCAST_IMG] Caption doesn't start with '#broadcast ', skipping")
+    # Parse `#broadcast <target> <message>` in one precompiled match
+    match = _BROADCAST_RE.match(caption)
+    if not match:
+        logger.info(f"[BROADCAST_IMG] Caption is not a valid #broadcast command, skipping")
         return  # Not a broadcast image
 
-    # Parse the caption: #broadcast <target> <message>
-    parts = caption.split(None, 2)  # Split into max 3 parts
-    logger.info(f"[BROADCAST_IMG] Parsed parts: {parts}")
-
-    if len(parts) < 2:
-        await update.message.reply_text(
-            "❌ **Invalid Format**\n\n"
-            "To broadcast an image, send a photo with caption:\n"
-            "`#broadcast users <message>`\n"
-            "`#broadcast groups <message>`\n"
-            "`#broadcast all <message>`\n\n"
-            "Example:\n"
-            "Send photo with caption: `#broadcast all Check out this new feature!`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
-    target = parts[1].lower()
-    message = parts[2] if len(parts) > 2 else ""
-
-    if target not in ['users', 'groups', 'all']:
-        await update.message.reply_text(
-            "❌ Invalid target. Use: `users`, `groups`, or `all`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
+    target = match.group(1).lower()
+    message = match.group(2) or ""
 
-    # Get chat IDs based on target
-    if target == 'users':
-        chat_ids = usage_tracker.get_all_user_chats()
-        target_name = "users"
-    elif target == 'groups':
-        chat_ids = usage_tracker.get_all_group_chats()
-        target_name = "groups"
-    else:  # all
-        chat_ids = usage_tracker.get_all_user_chats() + usage_tracker.get_all_group_chats()
-        target_name = "all users and groups"
+    # Get chat IDs based on target (deduplicated for 'all')
+    chat_ids = usage_tracker.get_broadcast_targets(target)
+    target_name = _BROADCAST_TARGET_NAMES[target]
 
     if not chat_ids:
         await update.message.reply_text(f"⚠️ No {target_name} found to broadcast to.")
@@ -2414,32 +3379,24 @@ async def broadcast_image_handler(update: Update, context: ContextTypes.DEFAULT_
     photo = update.message.photo[-1]  # Get largest photo
 
     # Confirm broadcast
-    await update.message.reply_text(
+    status_message = await update.message.reply_text(
         f"📢 **Broadcasting image to {len(chat_ids)} {target_name}...**\n\n"
         f"Caption: {message if message else '(no caption)'}\n\n"
         "Please wait..."
     )
 
-    # Send broadcast
-    success_count = 0
-    fail_count = 0
-
-    # Prepare caption with announcement header
+    # Send broadcast concurrently (bounded by BROADCAST_CONCURRENCY)
     full_caption = f"📢 **Announcement from NovaAI**\n\n{message}" if message else "📢 **Announcement from NovaAI**"
 
-    for chat_id in chat_ids:
-        try:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo.file_id,
-                caption=full_caption,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            success_count += 1
-            await asyncio.sleep(0.05)  # Small delay to avoid rate limiting
-        except Exception as e:
-            logger.error(f"[BROADCAST_IMG] Failed to send to {chat_id}: {e}")
-            fail_count += 1
+    async def _send_one(chat_id: int):
+        await context.bot.send_photo(
+            chat_id=chat_id,
+            photo=photo.file_id,
+            caption=full_caption,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    success_count, fail_count = await run_broadcast(_send_one, chat_ids, status_message)
 
     # Report results
     result_message = (
@@ -2457,21 +3414,9 @@ async def broadcast_image_handler(update: Update, context: ContextTypes.DEFAULT_
 # Advertisement Configuration Handlers (Owner Only)
 # ============================================================================
 
+@owner_private_only(rejected=ConversationHandler.END)
 async def setad_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start ad configuration process (Owner only)"""
-    if not await owner_only(update, context):
-        return ConversationHandler.END
-
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return ConversationHandler.END
-
     # Show options for ad type
     keyboard = [
         [InlineKeyboardButton("📝 Set Text Ad", callback_data="adtype_text")],
@@ -2635,21 +3580,9 @@ async def cancel_ad_config(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@owner_private_only
 async def togglead_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Toggle advertisement on/off (Owner only)"""
-    if not await owner_only(update, context):
-        return
-
-    # Only allow in private chats
-    if update.effective_chat.type != 'private':
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Owner commands only work in private chat with the bot.\n"
-            "Please use these commands in a direct message, not in groups.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-
     new_status = ad_manager.toggle()
     status_text = "✅ Enabled" if new_status else "❌ Disabled"
     emoji = "🟢" if new_status else "🔴"
@@ -2680,26 +3613,11 @@ async def togglead_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Scheduled Advertisement Management Handlers (Owner Only)
 # ============================================================================
 
+@owner_private_only(rejected=ConversationHandler.END)
 async def createad_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start creating a new scheduled advertisement (Owner only)"""
     user_id = update.effective_user.id
-    chat_type = update.effective_chat.type
-    logger.info(f"[CREATEAD] Command triggered by user {user_id} in {chat_type} chat")
-
-    if not await owner_only(update, context):
-        logger.warning(f"[CREATEAD] Access denied for user {user_id}")
-        return ConversationHandler.END
-
-    if chat_type != 'private':
-        logger.info(f"[CREATEAD] Rejected - not in private chat (type: {chat_type})")
-        await update.message.reply_text(
-            "⚠️ **Admin Commands in Private Only**\n\n"
-            "Please use this command in a direct message with the bot.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return ConversationHandler.END
-
-    logger.info(f"[CREATEAD] Starting ad creation wizard for owner {user_id}")
+    logger.info("[CREATEAD] Starting ad creation wizard for owner %s", user_id)
 
     await update.message.reply_text(
         "📢 **Create New Scheduled Advertisement**\n\n"
@@ -3216,6 +4134,65 @@ async def cancel_scheduled_ad(update: Update, context: ContextTypes.DEFAULT_TYPE
     return ConversationHandler.END
 
 
+# Telegram's hard limit is 4096 chars; leave headroom for the footer
+MAX_MESSAGE_LENGTH = 4000
+
+# Responses longer than this get their regex-heavy LaTeX conversion run on a
+# worker thread so the event loop stays responsive; below it the thread-hop
+# overhead outweighs the work
+FORMAT_OFFLOAD_THRESHOLD = 2000
+
+
+async def send_ai_response(update: Update, ai_response: str, footer: str):
+    """Format an AI answer and send it, splitting long answers at newlines.
+
+    Runs the LaTeX conversion once over the full text and splits the already
+    formatted string, so long answers are not re-scanned per part. The footer
+    is only attached to the final message.
+
+    Parts are deliberately sent without a parse_mode: the Unicode conversion
+    means there is no markup left to render, and skipping MarkdownV2 removes
+    the whole class of escape errors that would otherwise force a second
+    plain-text send per failed message.
+    """
+    if len(ai_response) > FORMAT_OFFLOAD_THRESHOLD:
+        formatted_response = await asyncio.to_thread(convert_latex_to_telegram, ai_response)
+    else:
+        formatted_response = convert_latex_to_telegram(ai_response)
+    full_response = formatted_response + footer
+
+    if len(full_response) <= MAX_MESSAGE_LENGTH:
+        # Send as single message (plain text - no markdown parsing needed)
+        await update.message.reply_text(full_response)
+        return
+
+    # Split the formatted body at line boundaries; the footer rides on the
+    # last part only. Cumulative line lengths + bisect find each split point
+    # directly, avoiding the O(n^2) string-append loop this used to be.
+    lines = formatted_response.split('\n')
+    # cum[i] = length of lines[0..i] joined by '\n', plus one trailing char
+    cum = list(itertools.accumulate(len(line) + 1 for line in lines))
+
+    parts = []
+    start = 0
+    base = 0
+    while start < len(lines):
+        end = bisect.bisect_right(cum, base + MAX_MESSAGE_LENGTH + 1)
+        if end <= start:
+            end = start + 1  # single line longer than the limit
+        parts.append('\n'.join(lines[start:end]))
+        base = cum[end - 1]
+        start = end
+
+    # No artificial delay between parts: the application's AIORateLimiter
+    # spaces sends when needed and retries on RetryAfter
+    for i, part in enumerate(parts):
+        if i == len(parts) - 1:
+            await update.message.reply_text(part + footer)
+        else:
+            await update.message.reply_text(part)
+
+
 async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user questions (text only) with AI response"""
     user_id = update.effective_user.id
@@ -3228,7 +4205,7 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # In group chats, only respond if bot is mentioned
     if not is_bot_mentioned(update, context):
-        logger.info(f"[BOT] Ignoring message in group {chat.id} - bot not mentioned")
+        logger.debug("[BOT] Ignoring message in group %s - bot not mentioned", chat.id)
         return
 
     # Skip AI processing if owner has disabled AI mode
@@ -3246,35 +4223,12 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # Check if it's a daily limit issue or credit issue
             if daily_usage >= daily_limit:
-                limit_message = (
-                    "⏰ **Daily Limit Reached!**\n\n"
-                    f"📊 You've used **{daily_usage}/{daily_limit} credits** today.\n"
-                    f"⏱️ Your limit will reset tomorrow.\n\n"
-                    "💡 **Why daily limits?**\n"
-                    "To ensure fair usage for all users.\n\n"
-                    f"📱 Want unlimited access? Download Nova Learn App:\n{NOVA_LEARN_APP_LINK}\n\n"
-                    "Get:\n"
-                    "✨ Unlimited AI-powered answers\n"
-                    "✨ Advanced learning features\n"
-                    "✨ Personalized study plans\n"
-                    "✨ And much more!\n\n"
-                    f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
+                limit_message = DAILY_LIMIT_MESSAGE_TEMPLATE.format(
+                    daily_usage=daily_usage, daily_limit=daily_limit
                 )
             else:
-                limit_message = (
-                    "⚠️ **Insufficient Credits!**\n\n"
-                    f"💰 Your Balance: **{credits} credits**\n"
-                    f"💳 Required: **{usage_tracker.TEXT_QUESTION_COST} credit**\n"
-                    f"📊 Daily Usage: **{daily_usage}/{daily_limit} credits**\n\n"
-                    "🚀 Get more credits:\n\n"
-                    "Use /credits to see available packages\n\n"
-                    f"📱 Or download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
-                    "Get:\n"
-                    "✨ Unlimited AI-powered answers\n"
-                    "✨ Advanced learning features\n"
-                    "✨ Personalized study plans\n"
-                    "✨ And much more!\n\n"
-                    f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
+                limit_message = INSUFFICIENT_CREDITS_TEXT_TEMPLATE.format(
+                    credits=credits, daily_usage=daily_usage, daily_limit=daily_limit
                 )
             reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
             await update.message.reply_text(limit_message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
@@ -3295,7 +4249,7 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     try:
-        logger.info(f"[BOT] Text question from user {user_id}: {question[:100]}...")
+        logger.info("[BOT] Text question from user %s: %.100s...", user_id, question)
 
         # Get AI response with fallback chain (no image)
         message_length = len(question)
@@ -3304,16 +4258,13 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not ai_response or not ai_response.strip():
             raise Exception("Received empty response from AI")
 
-        logger.info(f"[BOT] Got response: {len(ai_response)} chars, model: {metadata.get('model')}")
+        logger.info("[BOT] Got response: %s chars, model: %s", len(ai_response), metadata.get('model'))
 
         # Record the question and deduct credits (skip for owner)
         if not is_owner(user_id):
             usage_tracker.record_question(user_id, username, is_image=False)
             remaining_credits = usage_tracker.get_credits(user_id)
-            logger.info(f"[CREDITS] User {user_id} has {remaining_credits} credits remaining")
-
-        # Convert LaTeX to Unicode plain text
-        formatted_response = convert_latex_to_telegram(ai_response)
+            logger.debug("[CREDITS] User %s has %s credits remaining", user_id, remaining_credits)
 
         # Add footer with credit info
         if is_owner(user_id):
@@ -3331,42 +4282,9 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"📱 Get more: /credits or {NOVA_LEARN_APP_LINK}"
             )
 
-        full_response = formatted_response + footer
-
-        # Split long messages (Telegram limit: 4096 chars)
-        MAX_MESSAGE_LENGTH = 4000
-
-        if len(full_response) <= MAX_MESSAGE_LENGTH:
-            # Send as single message (plain text - no markdown parsing needed)
-            await update.message.reply_text(full_response)
-        else:
-            # Split into multiple messages
-            parts = []
-            current_part = ""
-
-            for line in full_response.split('\n'):
-                if len(current_part) + len(line) + 1 > MAX_MESSAGE_LENGTH:
-                    parts.append(current_part)
-                    current_part = line
-                else:
-                    current_part += ("\n" if current_part else "") + line
-
-            if current_part:
-                parts.append(current_part)
+        await send_ai_response(update, ai_response, footer)
 
-            # Send parts
-            for i, part in enumerate(parts):
-                # Only add footer to last part
-                if i == len(parts) - 1:
-                    await update.message.reply_text(part + footer)
-                else:
-                    await update.message.reply_text(part)
-
-                # Small delay between messages
-                if i < len(parts) - 1:
-                    await asyncio.sleep(0.5)
-
-        logger.info(f"[BOT] ✅ Response sent successfully to user {user_id}")
+        logger.debug("[BOT] ✅ Response sent successfully to user %s", user_id)
 
         # Send advertisement after successful response
         await send_advertisement(update, context)
@@ -3378,21 +4296,9 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except Exception as e:
         logger.error(f"[BOT] Error processing question: {e}", exc_info=True)
-        error_message = (
-            "❌ Sorry, I encountered an error processing your question.\n\n"
-            "This could be due to:\n"
-            "• High server load\n"
-            "• Complex question requiring more processing\n"
-            "• Temporary API issues\n\n"
-            "Please try:\n"
-            "• Simplifying your question\n"
-            "• Trying again in a few moments\n\n"
-            f"📱 For unlimited access and priority support:\n{NOVA_LEARN_APP_LINK}\n\n"
-            f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}"
-        )
         # Show keyboard in error message too
         reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
-        await update.message.reply_text(error_message, reply_markup=reply_markup)
+        await update.message.reply_text(ERROR_MESSAGE_TEXT, reply_markup=reply_markup)
 
 
 async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3407,8 +4313,9 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
     # Get caption as the question, or use default
     question = update.message.caption or "Please analyze this image and explain what you see. If it's a problem, solve it. If it's a diagram, explain it."
 
-    # If caption starts with #broadcast, it should be handled by broadcast handler
-    # This is a safety check in case the handler didn't catch it
+    # Valid #broadcast captions are routed to broadcast_image_handler by the
+    # CaptionRegex filter, so anything reaching here is malformed - surface
+    # the format help to the owner instead of answering it as a question
     if question.startswith("#broadcast"):
         if is_owner(user_id):
             await update.message.reply_text(
@@ -3424,7 +4331,7 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
 
     # In group chats, only respond if bot is mentioned
     if not is_bot_mentioned(update, context):
-        logger.info(f"[BOT] Ignoring photo in group {chat.id} - bot not mentioned")
+        logger.debug("[BOT] Ignoring photo in group %s - bot not mentioned", chat.id)
         # Send a helpful message to guide users (only occasionally to avoid spam)
         if random.random() < 0.3:  # 30% chance to show hint
             bot_username = context.bot.username
@@ -3451,36 +4358,12 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
 
             # Check if it's a daily limit issue or credit issue
             if daily_usage >= daily_limit:
-                limit_message = (
-                    "⏰ **Daily Limit Reached!**\n\n"
-                    f"📊 You've used **{daily_usage}/{daily_limit} credits** today.\n"
-                    f"⏱️ Your limit will reset tomorrow.\n\n"
-                    "💡 **Why daily limits?**\n"
-                    "To ensure fair usage for all users.\n\n"
-                    f"📱 Want unlimited access? Download Nova Learn App:\n{NOVA_LEARN_APP_LINK}\n\n"
-                    "Get:\n"
-                    "✨ Unlimited AI-powered answers\n"
-                    "✨ Advanced learning features\n"
-                    "✨ Personalized study plans\n"
-                    "✨ And much more!\n\n"
-                    f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
+                limit_message = DAILY_LIMIT_MESSAGE_TEMPLATE.format(
+                    daily_usage=daily_usage, daily_limit=daily_limit
                 )
             else:
-                limit_message = (
-                    "⚠️ **Insufficient Credits!**\n\n"
-                    f"💰 Your Balance: **{credits} credits**\n"
-                    f"💳 Required: **{usage_tracker.IMAGE_QUESTION_COST} credits**\n"
-                    f"📊 Daily Usage: **{daily_usage}/{daily_limit} credits**\n\n"
-                    "📸 Image questions cost more due to higher processing requirements.\n\n"
-                    "🚀 Get more credits:\n\n"
-                    "Use /credits to see available packages\n\n"
-                    f"📱 Or download Nova Learn App for unlimited access:\n{NOVA_LEARN_APP_LINK}\n\n"
-                    "Get:\n"
-                    "✨ Unlimited AI-powered answers\n"
-                    "✨ Advanced learning features\n"
-                    "✨ Personalized study plans\n"
-                    "✨ And much more!\n\n"
-                    f"📢 Join our WhatsApp channel:\n{WHATSAPP_CHANNEL_LINK}"
+                limit_message = INSUFFICIENT_CREDITS_PHOTO_TEMPLATE.format(
+                    credits=credits, daily_usage=daily_usage, daily_limit=daily_limit
                 )
             reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
             await update.message.reply_text(limit_message, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
@@ -3501,7 +4384,7 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
     try:
-        logger.info(f"[BOT] Photo question from user {user_id}: {question[:100]}...")
+        logger.info("[BOT] Photo question from user %s: %.100s...", user_id, question)
 
         # Get the largest photo (best quality)
         photo = update.message.photo[-1]
@@ -3510,7 +4393,7 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
         try:
             base64_image, mime_type = await process_telegram_photo(photo, context)
             image_data = (base64_image, mime_type)
-            logger.info(f"[BOT] Image processed successfully")
+            logger.debug("[BOT] Image processed successfully")
         except ValueError as ve:
             # Image too large
             error_message = (
@@ -3544,16 +4427,13 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
         if not ai_response or not ai_response.strip():
             raise Exception("Received empty response from AI")
 
-        logger.info(f"[BOT] Got response: {len(ai_response)} chars, model: {metadata.get('model')}")
+        logger.info("[BOT] Got response: %s chars, model: %s", len(ai_response), metadata.get('model'))
 
         # Record the question and deduct credits (skip for owner)
         if not is_owner(user_id):
             usage_tracker.record_question(user_id, username, is_image=True)
             remaining_credits = usage_tracker.get_credits(user_id)
-            logger.info(f"[CREDITS] User {user_id} has {remaining_credits} credits remaining")
-
-        # Convert LaTeX to Unicode plain text
-        formatted_response = convert_latex_to_telegram(ai_response)
+            logger.debug("[CREDITS] User %s has %s credits remaining", user_id, remaining_credits)
 
         # Add footer with credit info
         if is_owner(user_id):
@@ -3573,42 +4453,9 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
                 f"📱 Get more: /credits or {NOVA_LEARN_APP_LINK}"
             )
 
-        full_response = formatted_response + footer
-
-        # Split long messages (Telegram limit: 4096 chars)
-        MAX_MESSAGE_LENGTH = 4000
-
-        if len(full_response) <= MAX_MESSAGE_LENGTH:
-            # Send as single message (plain text - no markdown parsing needed)
-            await update.message.reply_text(full_response)
-        else:
-            # Split into multiple messages
-            parts = []
-            current_part = ""
-
-            for line in full_response.split('\n'):
-                if len(current_part) + len(line) + 1 > MAX_MESSAGE_LENGTH:
-                    parts.append(current_part)
-                    current_part = line
-                else:
-                    current_part += ("\n" if current_part else "") + line
-
-            if current_part:
-                parts.append(current_part)
-
-            # Send parts
-            for i, part in enumerate(parts):
-                # Only add footer to last part
-                if i == len(parts) - 1:
-                    await update.message.reply_text(part + footer)
-                else:
-                    await update.message.reply_text(part)
-
-                # Small delay between messages
-                if i < len(parts) - 1:
-                    await asyncio.sleep(0.5)
+        await send_ai_response(update, ai_response, footer)
 
-        logger.info(f"[BOT] ✅ Response sent successfully to user {user_id}")
+        logger.debug("[BOT] ✅ Response sent successfully to user %s", user_id)
 
         # Send advertisement after successful response
         await send_advertisement(update, context)
@@ -3620,23 +4467,9 @@ async def handle_photo_question(update: Update, context: ContextTypes.DEFAULT_TY
 
     except Exception as e:
         logger.error(f"[BOT] Error processing photo question: {e}", exc_info=True)
-        error_message = (
-            "❌ Sorry, I encountered an error processing your image.\n\n"
-            "This could be due to:\n"
-            "• Image format not supported\n"
-            "• High server load\n"
-            "• Complex image requiring more processing\n"
-            "• Temporary API issues\n\n"
-            "Please try:\n"
-            "• Using a clearer image\n"
-            "• Adding a text caption describing what you need help with\n"
-            "• Trying again in a few moments\n\n"
-            f"📱 For unlimited access and priority support:\n{NOVA_LEARN_APP_LINK}\n\n"
-            f"📢 Join our WhatsApp channel: {WHATSAPP_CHANNEL_LINK}"
-        )
         # Show keyboard in error message too
         reply_markup = get_main_keyboard(update.effective_user.id) if update.effective_chat.type == 'private' else None
-        await update.message.reply_text(error_message, reply_markup=reply_markup)
+        await update.message.reply_text(ERROR_MESSAGE_PHOTO, reply_markup=reply_markup)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3654,11 +4487,25 @@ def main():
         logger.error("OPENAI_API_KEY not found in environment variables!")
         return
 
-    # Create application with JobQueue enabled
+    # Create application with JobQueue enabled and centralised rate limiting
+    # (30/s global and 20/min per-group caps, with auto-retry on RetryAfter).
+    # Bot API requests go over an HTTP/2 connection pool so concurrent sends
+    # (e.g. broadcast fan-out) multiplex over a few kept-alive sockets
+    # instead of opening one TLS connection per request.
     application = (
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
+        .request(HTTPXRequest(http_version="2", connection_pool_size=64))
+        .get_updates_request(HTTPXRequest(http_version="2", connection_pool_size=8))
+        .concurrent_updates(True)
         .job_queue(JobQueue())
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=28,
+            overall_time_period=1,
+            group_max_rate=18,
+            group_time_period=60,
+            max_retries=3,
+        ))
         .build()
     )
 
@@ -3731,7 +4578,7 @@ def main():
     broadcast_conv = ConversationHandler(
         entry_points=[
             CommandHandler('broadcastimg', start_image_broadcast),
-            MessageHandler(filters.PHOTO & filters.User(user_id=int(OWNER_USER_ID)), start_image_broadcast)
+            MessageHandler(filters.PHOTO & filters.User(user_id=OWNER_IDS), start_image_broadcast)
         ],
         states={
             WAITING_FOR_BROADCAST_CAPTION: [
@@ -3749,21 +4596,24 @@ def main():
     application.add_handler(CallbackQueryHandler(handle_delete_confirmation, pattern='^(deleteconfirm_|deletecancel)'))
     application.add_handler(CallbackQueryHandler(settings_callback_handler))
 
-    # Handle broadcast images from owner (checked first before regular photo questions)
-    # Use a more permissive filter and check inside the handler
+    # Handle broadcast images from owner (checked first before regular photo
+    # questions); the precompiled caption filter keeps ordinary captioned
+    # photos from ever dispatching to the broadcast handler
     application.add_handler(
         MessageHandler(
-            filters.PHOTO & filters.CAPTION,
+            filters.PHOTO & filters.CaptionRegex(_BROADCAST_RE),
             broadcast_image_handler
         ),
         group=0  # Higher priority group
     )
 
-    # Handle photo messages (questions with images)
+    # Handle photo messages (questions with images); block=False so a slow
+    # AI call doesn't serialize the rest of this update's handler groups
     application.add_handler(
         MessageHandler(
             filters.PHOTO,
-            handle_photo_question
+            handle_photo_question,
+            block=False
         ),
         group=1  # Lower priority group
     )
@@ -3778,11 +4628,13 @@ def main():
         group=0  # Higher priority
     )
 
-    # Handle all text messages (questions without images)
+    # Handle all text messages (questions without images); block=False for
+    # the same reason as the photo handler
     application.add_handler(
         MessageHandler(
             filters.TEXT & ~filters.COMMAND,
-            handle_question
+            handle_question,
+            block=False
         ),
         group=1  # Lower priority
     )
@@ -3796,6 +4648,9 @@ def main():
     # Initialize the application and start scheduler
     application.post_init = start_scheduler_task
 
+    # Flush pending usage data and close pooled connections on shutdown
+    application.post_shutdown = shutdown_cleanup
+
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 